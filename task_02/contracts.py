@@ -2,14 +2,15 @@ from dataclasses import dataclass
 import typing
 import numpy as np
 
+import expressions
+
 @dataclass
 class Func:
     
     func : typing.Union[str, int]
     def __post_init__(self):
-        func_text = f'''def _qrfunction(self, t):\n    return {self.func}'''
-        exec(func_text)
-        self.func = locals()['_qrfunction']
+        # validated here, compiled together with the other parts in ThermalModel.set_infos
+        self.tree = expressions.parse(self.func)
 
 @dataclass
 class ConnectionInfo:
@@ -28,11 +29,19 @@ class PartInfo:
     Q_R : Func
     
     connection_info : list[ConnectionInfo]
+    T_0 : float = 20
     
 converters = {
     Func : lambda s: Func(s)
 }
 
+@dataclass
+class Mesh:
+    name : str
+    vertices : np.ndarray
+    faces : np.ndarray
+    box : tuple
+
 @dataclass
 class Part:
     scene : object
@@ -0,0 +1,113 @@
+import ast
+import functools
+import types
+
+import numpy as np
+
+NUMPY_NAMES = (
+    "sin", "cos", "tan", "arcsin", "arccos", "arctan", "sinh", "cosh", "tanh",
+    "exp", "log", "log10", "sqrt", "abs", "sign", "floor", "ceil",
+    "minimum", "maximum", "clip", "where", "heaviside", "pi", "e",
+    "logical_and",
+)
+SAFE_NUMPY = types.SimpleNamespace(**{name : getattr(np, name) for name in NUMPY_NAMES})
+
+ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Compare, ast.IfExp,
+    ast.Constant, ast.Name, ast.Attribute, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd,
+    ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq,
+)
+
+def parse(expression):
+    tree = ast.parse(str(expression).strip(), mode="eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError(f"{type(node).__name__} is not allowed in {expression!r}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"only numeric constants are allowed in {expression!r}")
+        if isinstance(node, ast.Name) and node.id not in ("t", "np"):
+            raise ValueError(f"unknown name {node.id!r} in {expression!r}, only t and np are available")
+        if isinstance(node, ast.Attribute):
+            if not (isinstance(node.value, ast.Name) and node.value.id == "np" and node.attr in NUMPY_NAMES):
+                raise ValueError(f"attribute .{node.attr} is not allowed in {expression!r}, only np.<function>")
+        if isinstance(node, ast.Call) and node.keywords:
+            raise ValueError(f"keyword arguments are not allowed in {expression!r}")
+    # integer constants would make ** exact and unbounded, 9**9**9 would hang the load
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant):
+            node.value = float(node.value)
+    return tree
+
+def numpy_call(name, args):
+    return ast.Call(ast.Attribute(ast.Name("np", ast.Load()), name, ast.Load()), args, [])
+
+class ArrayConditionals(ast.NodeTransformer):
+    # `a if c else b` and `a < t < b` need a single truth value, which an array t
+    # doesn't have, so they are rewritten into their elementwise numpy forms
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        return numpy_call("where", [node.test, node.body, node.orelse])
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) == 1:
+            return node
+        lefts = [node.left] + node.comparators[:-1]
+        pairs = [ast.Compare(left, [op], [right]) for left, op, right in zip(lefts, node.ops, node.comparators)]
+        return functools.reduce(lambda a, b: numpy_call("logical_and", [a, b]), pairs)
+
+def vectorize(tree):
+    return ast.fix_missing_locations(ArrayConditionals().visit(tree))
+
+def depends_on_t(tree):
+    return any(isinstance(node, ast.Name) and node.id == "t" for node in ast.walk(tree))
+
+def evaluate(tree, t=0):
+    code = compile(vectorize(tree), "<Q_R>", "eval")
+    return eval(code, {"__builtins__" : {}, "np" : SAFE_NUMPY}, {"t" : t})
+
+def compile_vector(expressions):
+    # constants are evaluated once, and the distinct t-dependent expressions are
+    # joined into a single lambda returning a tuple, so one call covers every part
+    trees = [parse(expression) for expression in expressions]
+    base = np.zeros(len(trees))
+    dynamic, inverse, unique, bodies = [], [], {}, []
+    for k, tree in enumerate(trees):
+        if depends_on_t(tree):
+            key = ast.dump(tree)
+            if key not in unique:
+                unique[key] = len(bodies)
+                bodies.append(tree.body)
+            dynamic.append(k)
+            inverse.append(unique[key])
+        else:
+            try:
+                base[k] = evaluate(tree)
+            except ArithmeticError as error:
+                raise ValueError(f"{expressions[k]!r} cannot be evaluated: {error}") from error
+
+    if not dynamic:
+        def vector(t):
+            return np.broadcast_to(base, np.shape(t) + base.shape).copy()
+        return vector
+
+    function = ast.Expression(ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg="t")], kwonlyargs=[], kw_defaults=[], defaults=[]),
+        body=ast.Tuple(elts=bodies, ctx=ast.Load())
+    ))
+    function = vectorize(function)
+    unique_values = eval(compile(function, "<Q_R>", "eval"), {"__builtins__" : {}, "np" : SAFE_NUMPY})
+    dynamic, inverse = np.array(dynamic), np.array(inverse)
+
+    def vector(t):
+        result = np.broadcast_to(base, np.shape(t) + base.shape).copy()
+        values = unique_values(t)
+        if np.ndim(t):
+            values = np.stack(np.broadcast_arrays(t, *values)[1:], axis=-1)
+            result[..., dynamic] = values[..., inverse]
+        else:
+            result[dynamic] = np.array(values)[inverse]
+        return result
+    return vector
@@ -5,6 +5,7 @@ import pygame_gui.elements
 from pygame_gui.ui_manager import UIManager
 from pygame_gui.windows.ui_file_dialog import UIFileDialog
 from rocket import HotRocket
+import solution_io
 
 import logging
 
@@ -32,12 +33,14 @@ class SaveFileDialog(UIFileDialog):
 class RocketWindow(pygame_gui.elements.ui_window.UIWindow):
     def __init__(self, model_path, position, ui_manager, info_path=None):
         window_size = (800, 400)
+        controls_height = 30
         
         super().__init__(pygame.Rect(position, window_size), ui_manager,
                          window_display_title='Very Hot Rocket',
                          object_id='#rocket_window')
 
-        game_surface_size = self.get_container().get_size()
+        container_width, container_height = self.get_container().get_size()
+        game_surface_size = (container_width, container_height - controls_height)
         self.game_surface_element = pygame_gui.elements.ui_image.UIImage(pygame.Rect((0, 0),
                                                         game_surface_size),
                                             pygame.Surface(game_surface_size).convert(),
@@ -48,15 +51,91 @@ class RocketWindow(pygame_gui.elements.ui_window.UIWindow):
         self.rocket = HotRocket(model_path, *game_surface_size, info_path)
         self.is_active = False
 
+        controls_top = game_surface_size[1]
+        self.play_button = pygame_gui.elements.ui_button.UIButton(
+            pygame.Rect((0, controls_top), (70, controls_height)),
+            "Pause",
+            ui_manager,
+            container=self,
+            parent_element=self
+        )
+        self.slower_button = pygame_gui.elements.ui_button.UIButton(
+            pygame.Rect((70, controls_top), (30, controls_height)),
+            "-",
+            ui_manager,
+            container=self,
+            parent_element=self
+        )
+        self.speed_label = pygame_gui.elements.ui_label.UILabel(
+            pygame.Rect((100, controls_top), (100, controls_height)),
+            self.speed_text(),
+            ui_manager,
+            container=self,
+            parent_element=self
+        )
+        self.faster_button = pygame_gui.elements.ui_button.UIButton(
+            pygame.Rect((200, controls_top), (30, controls_height)),
+            "+",
+            ui_manager,
+            container=self,
+            parent_element=self
+        )
+        self.time_slider = pygame_gui.elements.ui_horizontal_slider.UIHorizontalSlider(
+            pygame.Rect((230, controls_top), (container_width - 330, controls_height)),
+            0.0,
+            (0.0, float(self.rocket.T)),
+            ui_manager,
+            container=self,
+            parent_element=self
+        )
+        self.time_label = pygame_gui.elements.ui_label.UILabel(
+            pygame.Rect((container_width - 100, controls_top), (100, controls_height)),
+            self.time_text(),
+            ui_manager,
+            container=self,
+            parent_element=self
+        )
+
+    def speed_text(self):
+        return f"{self.rocket.speed:g} s/s"
+
+    def time_text(self):
+        return f"t = {self.rocket.time:.0f} s"
+
+    def reset_playback(self):
+        self.time_slider.value_range = (0.0, float(self.rocket.T))
+        self.time_slider.set_current_value(self.rocket.time)
+
     def process_event(self, event):
         handled = super().process_event(event)
+        if event.type == pygame.USEREVENT:
+            if event.user_type == pygame_gui.UI_BUTTON_PRESSED:
+                if event.ui_element == self.play_button:
+                    if self.rocket.playing:
+                        self.rocket.pause()
+                    else:
+                        self.rocket.play()
+                    self.play_button.set_text("Pause" if self.rocket.playing else "Play")
+                if event.ui_element == self.slower_button:
+                    self.rocket.set_speed(self.rocket.speed / 2)
+                    self.speed_label.set_text(self.speed_text())
+                if event.ui_element == self.faster_button:
+                    self.rocket.set_speed(self.rocket.speed * 2)
+                    self.speed_label.set_text(self.speed_text())
+            if event.user_type == pygame_gui.UI_HORIZONTAL_SLIDER_MOVED:
+                if event.ui_element == self.time_slider:
+                    self.rocket.seek(event.value)
         if self.is_active:
             handled = self.rocket.process_event(event)
         return handled
 
     def update(self, time_delta):
-        if self.alive() and self.is_active:
+        if self.alive():
             self.rocket.update(time_delta)
+            # don't fight the user while the slider is being dragged
+            if self.rocket.playing and not self.time_slider.sliding_button.held:
+                self.time_slider.set_current_value(self.rocket.time)
+            self.time_label.set_text(self.time_text())
         super().update(time_delta)
         self.rocket.draw(self.game_surface_element.image)
 
@@ -180,6 +259,39 @@ class App:
                 'bottom_target' : self.num_points_label    
             }
         )
+        self.solution_format_label = pygame_gui.elements.ui_label.UILabel(
+            pygame.Rect((0, 20), (150, 50)),
+            "Solution format :",
+            self.ui_manager,
+            anchors={
+                'top': 'top',
+                'left': 'right',
+                'bottom': 'top',
+                'right': 'right',
+                'left_target': self.num_points_label,
+                'right_target' : self.num_points_label,
+                'top_target' : self.num_points_label,
+                'bottom_target' : self.num_points_label    
+            }
+        )
+        # csv keeps 4 significant digits and drops the time axis
+        self.solution_format = "npz"
+        self.solution_format_menu = pygame_gui.elements.UIDropDownMenu(
+            list(solution_io.FORMATS),
+            self.solution_format,
+            pygame.Rect((0, 0), (150, 50)),
+            self.ui_manager,
+            anchors={
+                'top': 'bottom',
+                'left': 'left',
+                'bottom': 'bottom',
+                'right': 'left',
+                'left_target': self.solution_format_label,
+                'right_target' : self.solution_format_label,
+                'top_target' : self.solution_format_label,
+                'bottom_target' : self.solution_format_label    
+            }
+        )
         
 
     def _on_choose_path_button(self, event):
@@ -201,7 +313,7 @@ class App:
             self.ui_manager,
             visible=False,
             allow_existing_files_only=False,
-            initial_file_path="sample.csv"
+            initial_file_path="sample." + self.solution_format
         )
         self.save_dialog.enable()
         self.save_dialog.show()
@@ -210,17 +322,22 @@ class App:
         self.rocket_window.rocket.load_info(event.text) 
         
     def _on_save_dialog_path_picked(self, event):
-        self.rocket_window.rocket.save_solution(event.text) 
+        self.rocket_window.rocket.save_solution(event.text, self.solution_format) 
+
+    def _on_solution_format_changed(self, event):
+        self.solution_format = event.text
 
     def _on_time_entry_line_finished(self, event):
         self.rocket_window.rocket._set_T(float(event.text))
         self.rocket_window.rocket.solve_ode()
         self.rocket_window.rocket.update_curve_plot()
+        self.rocket_window.reset_playback()
         
     def _on_num_points_entry_line_finished(self, event):
         self.rocket_window.rocket._set_num_points(int(event.text))
         self.rocket_window.rocket.solve_ode()
         self.rocket_window.rocket.update_curve_plot()
+        self.rocket_window.reset_playback()
 
     def _process_event(self, event):
         if event.type == pygame.QUIT:
@@ -240,6 +357,10 @@ class App:
                 if event.ui_element == self.save_dialog:
                     self._on_save_dialog_path_picked(event)
                     
+            if event.user_type == pygame_gui.UI_DROP_DOWN_MENU_CHANGED:
+                if event.ui_element == self.solution_format_menu:
+                    self._on_solution_format_changed(event)
+                    
             if event.user_type == pygame_gui.UI_TEXT_ENTRY_FINISHED:
                 if event.ui_element == self.time_entry_line:
                     self._on_time_entry_line_finished(event)
@@ -0,0 +1,64 @@
+import numpy as np
+
+from OpenGL.GL import *
+
+class MeshRenderer:
+
+    def __init__(self):
+        self.vertex_buffers = {}
+        self.index_buffers = {}
+
+    def upload_vertices(self, vertices):
+        # parts of one model share a vertex array, which is uploaded once
+        key = id(vertices)
+        if key not in self.vertex_buffers:
+            buffer = glGenBuffers(1)
+            data = np.ascontiguousarray(vertices, dtype=np.float32)
+            glBindBuffer(GL_ARRAY_BUFFER, buffer)
+            glBufferData(GL_ARRAY_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+            self.vertex_buffers[key] = (vertices, buffer)
+        return self.vertex_buffers[key][1]
+
+    def upload_indices(self, mesh):
+        key = id(mesh)
+        if key not in self.index_buffers:
+            buffer = glGenBuffers(1)
+            data = np.ascontiguousarray(mesh.faces, dtype=np.uint32)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffer)
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+            self.index_buffers[key] = (mesh, buffer, data.size)
+        return self.index_buffers[key][1:]
+
+    def upload(self, meshes):
+        # buffers are keyed by the mesh objects, so only a newly loaded model
+        # causes an upload, and buffers of the previous model are released
+        vertex_keys = {id(mesh.vertices) for mesh in meshes}
+        mesh_keys = {id(mesh) for mesh in meshes}
+        stale_vertices = [key for key in self.vertex_buffers if key not in vertex_keys]
+        stale_meshes = [key for key in self.index_buffers if key not in mesh_keys]
+        if stale_vertices or stale_meshes:
+            glDeleteBuffers(len(stale_vertices), [self.vertex_buffers.pop(key)[1] for key in stale_vertices])
+            glDeleteBuffers(len(stale_meshes), [self.index_buffers.pop(key)[1] for key in stale_meshes])
+
+        for mesh in meshes:
+            self.upload_vertices(mesh.vertices)
+            self.upload_indices(mesh)
+
+    def draw(self, meshes, colors):
+        self.upload(meshes)
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        for mesh, color in zip(meshes, colors):
+            glBindBuffer(GL_ARRAY_BUFFER, self.upload_vertices(mesh.vertices))
+            glVertexPointer(3, GL_FLOAT, 0, None)
+            index_buffer, count = self.upload_indices(mesh)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+            glColor3ub(*(int(c) for c in color[:3]))
+            glDrawElements(GL_TRIANGLES, count, GL_UNSIGNED_INT, None)
+        glDisableClientState(GL_VERTEX_ARRAY)
+
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+
+    def release(self):
+        self.upload([])
@@ -0,0 +1,83 @@
+import os
+import pathlib
+
+import numpy as np
+
+import contracts
+
+CACHE_VERSION = 1
+
+def cache_path(path):
+    return path.with_name(path.name + ".npz")
+
+def triangulate(polygon):
+    # fan triangulation, the same as pywavefront does for quads and n-gons
+    return [(polygon[0], polygon[k], polygon[k + 1]) for k in range(1, len(polygon) - 1)]
+
+def parse_obj(path):
+    vertices = []
+    names = []
+    groups = []
+    n_vertices = 0
+
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("v "):
+                vertices.append(line[2:])
+                n_vertices += 1
+            elif line.startswith("f "):
+                if not groups:
+                    names.append("default")
+                    groups.append([])
+                polygon = []
+                for token in line[2:].split():
+                    index = int(token.split("/", 1)[0])
+                    polygon.append(index - 1 if index > 0 else n_vertices + index)
+                groups[-1].extend(triangulate(polygon))
+            elif line.startswith("g ") or line.rstrip() == "g":
+                names.append(line[2:].strip() or f"group{len(groups)}")
+                groups.append([])
+
+    vertices = np.array(" ".join(vertices).split(), dtype=np.float32).reshape(-1, 3)
+    faces = [np.array(group, dtype=np.int32).reshape(-1, 3) for group in groups]
+    return vertices, names, faces
+
+def save_cache(path, stat, vertices, names, faces):
+    arrays = {f"faces_{k}" : group for k, group in enumerate(faces)}
+    tmp_path = cache_path(path).with_suffix(".tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                version=CACHE_VERSION, mtime=stat.st_mtime_ns, size=stat.st_size,
+                vertices=vertices, names=np.array(names), **arrays
+            )
+        os.replace(tmp_path, cache_path(path))
+    except OSError:
+        # read-only model directories just don't get a cache
+        pass
+
+def load_cache(path, stat):
+    try:
+        with np.load(cache_path(path)) as data:
+            if int(data["version"]) != CACHE_VERSION or int(data["mtime"]) != stat.st_mtime_ns or int(data["size"]) != stat.st_size:
+                return None
+            names = [str(name) for name in data["names"]]
+            faces = [data[f"faces_{k}"] for k in range(len(names))]
+            return data["vertices"], names, faces
+    except (OSError, KeyError, ValueError):
+        return None
+
+def load_obj(path, use_cache=True):
+    path = pathlib.Path(path)
+    stat = path.stat()
+
+    loaded = load_cache(path, stat) if use_cache else None
+    if loaded is None:
+        loaded = parse_obj(path)
+        if use_cache:
+            save_cache(path, stat, *loaded)
+    vertices, names, faces = loaded
+
+    box = (vertices.min(axis=0), vertices.max(axis=0)) if len(vertices) else (np.zeros(3), np.zeros(3))
+    return [contracts.Mesh(name, vertices, group, box) for name, group in zip(names, faces)]
@@ -0,0 +1,101 @@
+import json
+import pathlib
+from dataclasses import dataclass
+
+import numpy as np
+
+FORMATS = ("csv", "npy", "npz")
+HEADER_SIZE = 128
+
+@dataclass
+class Solution:
+    t : np.ndarray
+    sol : np.ndarray
+    ids : list
+    names : list
+
+def metadata_path(path):
+    path = pathlib.Path(path)
+    return path.with_name(path.name + ".json")
+
+def resolve_format(path, format=None):
+    path = pathlib.Path(path)
+    format = format or path.suffix.lstrip(".").lower() or "csv"
+    if format not in FORMATS:
+        raise ValueError(f"unknown solution format {format!r}, expected one of {FORMATS}")
+    if path.suffix.lstrip(".").lower() != format:
+        path = path.with_name(path.name + "." + format)
+    return path, format
+
+class NpyWriter:
+    # rows of (t, T_0 .. T_n) are appended to a .npy whose header is rewritten
+    # in place, so the file is a valid, memory-mappable array after every append
+
+    def __init__(self, path, ids, names):
+        self.path = pathlib.Path(path)
+        self.n_columns = 1 + len(ids)
+        self.n_rows = 0
+        self.file = open(self.path, "wb")
+        self.write_header()
+        with open(metadata_path(self.path), "w", encoding="utf-8") as f:
+            json.dump({"columns" : ["t"] + [str(i) for i in ids], "ids" : list(ids), "names" : list(names)}, f, ensure_ascii=False)
+
+    def write_header(self):
+        header = {"descr" : "<f8", "fortran_order" : False, "shape" : (self.n_rows, self.n_columns)}
+        magic = np.lib.format.magic(1, 0)
+        text = repr(header).encode("latin1")
+        text += b" " * (HEADER_SIZE - len(magic) - 2 - len(text) - 1) + b"\n"
+        self.file.seek(0)
+        self.file.write(magic + np.uint16(len(text)).tobytes() + text)
+        self.file.seek(0, 2)
+
+    def append(self, t, sol):
+        rows = np.column_stack((np.atleast_1d(t), np.atleast_2d(sol))).astype("<f8", copy=False)
+        self.file.write(np.ascontiguousarray(rows).tobytes())
+        self.n_rows += rows.shape[0]
+        self.write_header()
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def save(path, t, sol, ids, names, format=None):
+    path, format = resolve_format(path, format)
+    if format == "csv":
+        np.savetxt(
+            path, 
+            sol, 
+            header=",".join(str(i) for i in range(sol.shape[1])),
+            delimiter=",",
+            comments='',
+            fmt="%.4e"
+        )
+    elif format == "npy":
+        with NpyWriter(path, ids, names) as writer:
+            writer.append(t, sol)
+    else:
+        columns = {f"T_{i}" : sol[:, k] for k, i in enumerate(ids)}
+        np.savez_compressed(path, t=t, ids=np.array(ids), names=np.array(names), **columns)
+    return path
+
+def load(path):
+    path, format = resolve_format(path)
+    if format == "csv":
+        # the text export has neither the time axis nor part names, t is None
+        sol = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        ids = list(range(sol.shape[1]))
+        return Solution(None, sol, ids, [str(i) for i in ids])
+    if format == "npy":
+        data = np.load(path, mmap_mode="r")
+        meta = json.load(open(metadata_path(path), encoding="utf-8"))
+        return Solution(data[:, 0], data[:, 1:], meta["ids"], meta["names"])
+    with np.load(path) as data:
+        ids = [int(i) for i in data["ids"]]
+        sol = np.column_stack([data[f"T_{i}"] for i in ids]) if ids else np.empty((len(data["t"]), 0))
+        return Solution(data["t"], sol, ids, [str(name) for name in data["names"]])
@@ -0,0 +1,138 @@
+import argparse
+import copy
+import csv
+import itertools
+import json
+import os
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import dacite
+
+import contracts
+from thermal_model import ThermalModel
+
+MODEL_PARAMETERS = ("T", "num_points")
+
+worker_base = None
+
+def grid_scenarios(grid):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def load_scenarios(path):
+    spec = json.load(open(path, encoding='utf-8'))
+    scenarios = grid_scenarios(spec.get("grid", {})) if "grid" in spec else []
+    return scenarios + list(spec.get("samples", []))
+
+def select(items, key):
+    return items if key == "*" else [item for item in items if item["id"] == int(key)]
+
+def apply_parameter(parts, name, value):
+    # "<part>.<field>" or "<part>.connection.<other part>.<field>", "*" matches every id
+    keys = name.split(".")
+    if len(keys) == 2:
+        for part in select(parts, keys[0]):
+            part[keys[1]] = value
+    elif len(keys) == 4 and keys[1] == "connection":
+        for part in select(parts, keys[0]):
+            for connection in select(part["connection_info"], keys[2]):
+                connection[keys[3]] = value
+    else:
+        raise ValueError(f"can't apply parameter {name!r}, expected T, num_points, <part>.<field> or <part>.connection.<part>.<field>")
+
+def build_model(base, scenario, T, num_points):
+    parts = copy.deepcopy(base)
+    settings = {"T" : T, "num_points" : num_points}
+    for name, value in scenario.items():
+        if name in MODEL_PARAMETERS:
+            settings[name] = value
+        else:
+            apply_parameter(parts, name, value)
+
+    model = ThermalModel(T=settings["T"], num_points=int(settings["num_points"]))
+    model.set_infos([
+        dacite.from_dict(data_class=contracts.PartInfo, data=part, config=dacite.Config(type_hooks=contracts.converters))
+        for part in parts
+    ])
+    return model
+
+def init_worker(base_path):
+    # each pool process reads the base description once and reuses it
+    global worker_base
+    worker_base = json.load(open(base_path, encoding='utf-8'))
+
+def run_scenario(index, scenario, T, num_points, stride):
+    try:
+        with np.errstate(all="ignore"):
+            model = build_model(worker_base, scenario, T, num_points)
+            model.solve_ode()
+        if not np.all(np.isfinite(model.sol)):
+            raise FloatingPointError("non-finite temperatures in the solution")
+        return index, None, model.t[::stride], model.sol[::stride]
+    except Exception:
+        return index, traceback.format_exc(limit=2).strip().splitlines()[-1], None, None
+
+def run(base_path, scenarios, out_path, T=1000, num_points=1000, stride=1, n_workers=None):
+    n_parts = len(json.load(open(base_path, encoding='utf-8')))
+    names = sorted({name for scenario in scenarios for name in scenario})
+    header = ["scenario", "status", "error"] + names + ["t"] + [f"T_{k}" for k in range(n_parts)]
+    n_failed = 0
+
+    n_workers = n_workers or os.cpu_count()
+    with open(out_path, "w", newline="") as f, \
+            ProcessPoolExecutor(n_workers, initializer=init_worker, initargs=(base_path,)) as pool:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        queue = enumerate(scenarios)
+        pending = set()
+
+        # only a couple of scenarios per worker are submitted at a time and results are
+        # written and dropped as they finish, so memory doesn't grow with the sweep
+        while True:
+            for k, scenario in itertools.islice(queue, 2 * n_workers - len(pending)):
+                pending.add(pool.submit(run_scenario, k, scenario, T, num_points, stride))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, error, t, sol = future.result()
+                params = [scenarios[index].get(name, "") for name in names]
+                if error is not None:
+                    n_failed += 1
+                    writer.writerow([index, "failed", error] + params + [""] * (1 + n_parts))
+                else:
+                    # floats are written with repr, which round-trips float64 exactly
+                    rows = np.column_stack((t, sol)).tolist()
+                    writer.writerows([index, "ok", ""] + params + row for row in rows)
+            f.flush()
+
+    return n_failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve many variants of a part description in parallel")
+    parser.add_argument("base", help="base part metadata JSON")
+    parser.add_argument("scenarios", nargs="?", help='JSON with a "grid" of parameter lists and/or a list of "samples"')
+    parser.add_argument("-p", "--param", nargs=2, action="append", default=[], metavar=("NAME", "VALUES"),
+                        help="add a grid axis, VALUES is a JSON list, e.g. -p 1.eps '[0.05, 0.1]'")
+    parser.add_argument("-o", "--out", default="sweep.csv")
+    parser.add_argument("-T", type=float, default=1000)
+    parser.add_argument("-n", "--num-points", type=int, default=1000)
+    parser.add_argument("--stride", type=int, default=1, help="write every stride-th time point")
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    scenarios = load_scenarios(args.scenarios) if args.scenarios else []
+    if args.param:
+        axes = grid_scenarios({name : json.loads(values) for name, values in args.param})
+        scenarios = [{**s, **a} for s in (scenarios or [{}]) for a in axes]
+    if not scenarios:
+        scenarios = [{}]
+
+    n_failed = run(args.base, scenarios, args.out, args.T, args.num_points, args.stride, args.workers)
+    print(f"{len(scenarios)} scenarios, {n_failed} failed, written to {args.out}")
+    return 1 if n_failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
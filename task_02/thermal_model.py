@@ -0,0 +1,155 @@
+import time
+IMPORT_START = time.perf_counter()
+
+import argparse
+import json
+import pathlib
+
+import numpy as np
+import dacite
+
+import contracts
+import expressions
+import solution_io
+
+IMPORT_END = time.perf_counter()
+
+class ThermalModel:
+
+    def __init__(self, info_path=None, T=1000, num_points=1000, rtol=1e-6, atol=1e-8):
+        self.rtol = rtol
+        self.atol = atol
+        self._set_T(T)
+        self._set_num_points(num_points)
+        if info_path:
+            self.load_info(info_path)
+
+    def read_info(self, info_path):
+        self.info_path = pathlib.Path(info_path)
+        info = json.load(open(self.info_path, encoding='utf-8'))
+        return [
+            dacite.from_dict(data_class=contracts.PartInfo, data=i, config=dacite.Config(type_hooks=contracts.converters))
+            for i in info
+        ]
+
+    def load_info(self, info_path):
+        self.set_infos(self.read_info(info_path))
+
+    def set_infos(self, infos):
+        self.infos = list(sorted(infos, key=lambda i: i.id))
+        self.q_r = expressions.compile_vector([i.Q_R.func for i in self.infos])
+        self.init_calc_data()
+        
+    def save_solution(self, path, format=None):
+        return solution_io.save(
+            path, self.t, self.sol,
+            [info.id for info in self.infos], [info.name for info in self.infos],
+            format
+        )
+        
+    def Q_TC(self, y, t):
+        return self.conduction @ y
+       
+    def Q_E(self, y):
+        return -self.eps * self.squares * self.C_0 * (y / 100) ** 4
+    
+    def Q_R(self, t):
+        return self.q_r(t)
+        
+    def calc_deriv(self, y, t):
+        return (self.Q_TC(y, t) + self.Q_E(y) + self.Q_R(t)) / self.c
+
+    def calc_jacobian(self, y, t):
+        from scipy import sparse
+
+        # conduction is linear, radiation only adds to the diagonal
+        d_Q_E = -4 * self.eps * self.squares * self.C_0 * y ** 3 / 100 ** 4
+        return self.inv_c @ (self.conduction + sparse.diags(d_Q_E))
+        
+    def init_calc_data(self):
+        from scipy import sparse
+
+        n = len(self.infos)
+        
+        self.c = np.zeros((n,))
+        self.eps = np.zeros((n,))
+        self.squares = np.zeros((n,))
+        self.y0 = np.zeros((n,))
+        self.C_0 = 5.67
+        
+        rows, cols, k = [], [], []
+        for info in self.infos:
+            self.eps[info.id] = info.eps
+            self.squares[info.id] = info.square
+            self.c[info.id] = info.c
+            self.y0[info.id] = info.T_0
+            for connection in info.connection_info:
+                rows.append(info.id)
+                cols.append(connection.id)
+                k.append(connection.lmbda * connection.square)
+
+        # heat flowing into j is sum_i k_ij * (y_i - y_j), i.e. the graph
+        # Laplacian K^T - diag(column sums of K)
+        self.k = sparse.csr_matrix((k, (rows, cols)), shape=(n, n))
+        self.conduction = (self.k.T - sparse.diags(np.asarray(self.k.sum(axis=0)).ravel())).tocsr()
+        self.inv_c = sparse.diags(1 / self.c)
+        
+    def _set_T(self, T):
+        self.T = T
+
+    def _set_num_points(self, num_points):
+        self.num_points = num_points
+        
+    def solve_ode(self):
+        from scipy.integrate import solve_ivp
+
+        self.t = np.linspace(0, self.T, self.num_points)
+        solution = solve_ivp(
+            lambda t, y: self.calc_deriv(y, t),
+            (0, self.T),
+            self.y0,
+            method="BDF",
+            t_eval=self.t,
+            jac=lambda t, y: self.calc_jacobian(y, t),
+            rtol=self.rtol,
+            atol=self.atol
+        )
+        if not solution.success:
+            raise RuntimeError(f"thermal model integration failed: {solution.message}")
+        self.sol = solution.y.T
+        self.maximum = np.max(self.sol)
+        self.minimum = np.min(self.sol)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve the rocket thermal model without the GUI")
+    parser.add_argument("info", help="part metadata JSON")
+    parser.add_argument("-o", "--out", default="solution.csv")
+    parser.add_argument("-f", "--format", choices=solution_io.FORMATS, default=None, help="defaults to the output extension")
+    parser.add_argument("-T", type=float, default=1000, help="simulated time, s")
+    parser.add_argument("-n", "--num-points", type=int, default=1000)
+    parser.add_argument("--rtol", type=float, default=1e-6)
+    parser.add_argument("--atol", type=float, default=1e-8)
+    parser.add_argument("--timing", action="store_true", help="print import, load, solve and save times")
+    args = parser.parse_args(argv)
+
+    timings = {"import" : IMPORT_END - IMPORT_START}
+    start = time.perf_counter()
+    model = ThermalModel(T=args.T, num_points=args.num_points, rtol=args.rtol, atol=args.atol)
+    model.load_info(args.info)
+    timings["load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.solve_ode()
+    timings["solve"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.save_solution(args.out, args.format)
+    timings["save"] = time.perf_counter() - start
+
+    if args.timing:
+        for name, seconds in timings.items():
+            print(f"{name:>6} : {seconds * 1000:.1f} ms")
+    return model
+
+if __name__ == "__main__":
+    main()
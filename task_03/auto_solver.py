@@ -0,0 +1,156 @@
+import json
+import os
+import platform
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import benchmark
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plots", "calibration.json")
+
+def host_key():
+    return f"{platform.node()}|{platform.machine()}|python {platform.python_version()}|numpy {np.__version__}"
+
+def interpolate(sizes, values, n_obj):
+    # piecewise linear in log-log space, extrapolating with the end segments;
+    # the slope is clamped to the O(1)..O(N^2) range so timing noise can't blow up
+    log_n, log_v = np.log(sizes), np.log(values)
+    i = int(np.clip(np.searchsorted(log_n, np.log(n_obj)) - 1, 0, len(sizes) - 2))
+    slope = np.clip((log_v[i + 1] - log_v[i]) / (log_n[i + 1] - log_n[i]), 0, 2)
+    return float(np.exp(log_v[i] + slope * (np.log(n_obj) - log_n[i])))
+
+@dataclass
+class AutoSolver:
+    dt : float
+    n_iters : int
+    G : float = 6.6743 * 10 ** -11
+    dtype : type = np.float64
+    backends : tuple = ("python", "cython", "multiprocessing", "opencl", "barnes-hut")
+    sizes : tuple = (16, 64, 256)
+    calibration_iters : tuple = (5, 25)
+    cache_path : str = CACHE_PATH
+    solvers : dict = field(default_factory=dict, init=False, repr=False)
+    calibration : dict = field(default=None, init=False, repr=False)
+    failed : set = field(default_factory=set, init=False, repr=False)
+
+    def __post_init__(self):
+        self.available = {}
+        for name in self.backends:
+            try:
+                self.available[name] = benchmark.load_backend(name)
+            except ImportError:
+                # backend not installed or extension not built
+                continue
+        self.choice = None
+
+    def solver(self, name):
+        if name not in self.solvers:
+            self.solvers[name] = self.available[name](dt=self.dt, n_iters=self.n_iters, G=self.G, dtype=self.dtype)
+        solver = self.solvers[name]
+        solver.n_iters = self.n_iters
+        return solver
+
+    def load_calibration(self):
+        if self.calibration is None:
+            self.calibration = {}
+            if os.path.exists(self.cache_path):
+                with open(self.cache_path) as f:
+                    self.calibration = json.load(f)
+        return self.calibration.setdefault(host_key(), {})
+
+    def save_calibration(self):
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.calibration, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def calibrate_backend(self, name, n_dim):
+        try:
+            solver = self.solver(name)
+        except Exception:
+            # installed but unusable here, e.g. no OpenCL platform
+            return None
+
+        short, long = self.calibration_iters
+        overhead, per_step = [], []
+        try:
+            for n_obj in self.sizes:
+                case = benchmark.make_test_case(n_obj, n_dim, self.dtype)
+                times = []
+                for iters in (short, long):
+                    solver.n_iters = iters
+                    times.append(benchmark.measure(solver.solve, warmup=1, repeats=3, **case.__dict__).median)
+                # a noisy difference must not make a step look free
+                step = max((times[1] - times[0]) / (long - short), 0.5 * times[1] / long)
+                per_step.append(step)
+                overhead.append(max(times[0] - step * short, 1e-6))
+        except Exception:
+            return None
+        finally:
+            solver.n_iters = self.n_iters
+
+        return {"sizes" : list(self.sizes), "overhead" : overhead, "per_step" : per_step}
+
+    def calibration_key(self, n_dim):
+        # timings only carry over between solvers measured the same way
+        short, long = self.calibration_iters
+        sizes = ",".join(str(n_obj) for n_obj in self.sizes)
+        return f"{n_dim}d|{np.dtype(self.dtype).name}|sizes {sizes}|iters {short},{long}"
+
+    def calibrate(self, n_dim, force=False):
+        host = self.load_calibration()
+        key = self.calibration_key(n_dim)
+        entries = host.setdefault(key, {})
+        changed = False
+        for name in self.available:
+            if force or (name not in entries and (key, name) not in self.failed):
+                entry = self.calibrate_backend(name, n_dim)
+                if entry is None:
+                    # failures may be transient (busy device, missing driver), so they are
+                    # only remembered by this instance and retried by the next one
+                    self.failed.add((key, name))
+                    entries.pop(name, None)
+                    continue
+                entries[name] = entry
+                changed = True
+        if changed:
+            self.save_calibration()
+        return entries
+
+    def predict(self, n_obj, n_dim, n_iters=None):
+        n_iters = self.n_iters if n_iters is None else n_iters
+        entries = self.calibrate(n_dim)
+        predictions = {}
+        for name in self.available:
+            entry = entries.get(name)
+            if entry is None:
+                continue
+            overhead = float(np.interp(n_obj, entry["sizes"], entry["overhead"]))
+            per_step = interpolate(entry["sizes"], entry["per_step"], n_obj)
+            predictions[name] = overhead + per_step * n_iters
+        return predictions
+
+    def select(self, n_obj, n_dim):
+        predictions = self.predict(n_obj, n_dim)
+        if not predictions:
+            raise RuntimeError("no usable n-body backend found")
+        self.choice = min(predictions, key=predictions.get)
+        return self.solver(self.choice)
+
+    def stream(self, r_0, v_0, m_0, every=1):
+        solver = self.select(*r_0.shape)
+        if not hasattr(solver, "stream"):
+            raise TypeError(f"{self.choice} backend does not support streaming")
+        return solver.stream(r_0, v_0, m_0, every)
+
+    def solve(self, r_0, v_0, m_0):
+        return self.select(*r_0.shape).solve(r_0, v_0, m_0)
+
+    def close(self):
+        for solver in self.solvers.values():
+            if hasattr(solver, "close"):
+                solver.close()
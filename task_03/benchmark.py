@@ -0,0 +1,218 @@
+import argparse
+import datetime
+import gc
+import importlib
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+
+import numpy as np
+
+BACKENDS = {
+    "odeint" : "python_solvers.OdeintSolver",
+    "python" : "python_solvers.PythonVerletSolver",
+    "cython" : "cython_solver.CythonSolver",
+    "multiprocessing" : "python_solvers.MultiprocessingVerletSolver",
+    "opencl" : "opencl_solver.OpenCLSolver",
+    "barnes-hut" : "python_solvers.BarnesHutVerletSolver",
+    "block-hermite" : "python_solvers.BlockTimestepHermiteSolver",
+    "yoshida4" : "integrators.SymplecticSolver",
+}
+
+@dataclass
+class InitData:
+    dt : float
+    n_iters : int
+    G : float = 6.6743 * 10 ** -11
+
+@dataclass
+class TestData:
+    r_0 : np.ndarray
+    v_0 : np.ndarray
+    m_0 : np.ndarray
+
+@dataclass
+class Measurement:
+    median : float
+    q1 : float
+    q3 : float
+    min : float
+    max : float
+    repeats : int
+
+    @property
+    def spread(self):
+        return self.q3 - self.q1
+
+def make_test_case(n_obj, n_dim, dtype=np.float64, seed=0):
+    rng = np.random.default_rng(seed)
+    r = rng.random((n_obj, n_dim)).astype(dtype)
+    v = rng.random((n_obj, n_dim)).astype(dtype)
+    m = rng.random((n_obj,)).astype(dtype)
+    return TestData(r, v, m)
+
+def load_backend(name):
+    module_name, cls_name = BACKENDS[name].rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), cls_name)
+
+def measure(func, *args, warmup=1, repeats=5, **kwargs):
+    for _ in range(warmup):
+        func(*args, **kwargs)
+
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            samples.append(time.perf_counter() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    q1, median, q3 = np.percentile(samples, [25, 50, 75])
+    return Measurement(float(median), float(q1), float(q3), min(samples), max(samples), repeats)
+
+def peak_memory(func, *args, **kwargs):
+    # only allocations of this process are traced, worker processes and
+    # OpenCL device buffers are not included
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def import_cost(module_name):
+    code = f"import time; start = time.perf_counter(); import {module_name}; print(time.perf_counter() - start)"
+    # run next to the solver modules, whatever the caller's working directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=here)
+    return float(result.stdout)
+
+def construction_cost(solver_cls, init_data, test_case):
+    start = time.perf_counter()
+    solver = solver_cls(**init_data.__dict__)
+    construct = time.perf_counter() - start
+
+    # the first solve pays for lazy setup (worker spin-up, OpenCL builds, workspaces)
+    # on top of a full solve; run() subtracts the steady-state median as "first_solve_overhead"
+    start = time.perf_counter()
+    solver.solve(**test_case.__dict__)
+    first_solve = time.perf_counter() - start
+    return solver, {"construct" : construct, "first_solve" : first_solve}
+
+def run(solver_classes, n_bodies, n_dims, n_iters, dt=1.5 * 10 ** 7, warmup=1, repeats=5, memory=True):
+    results = []
+    import_costs = {}
+    for name, solver_cls in solver_classes.items():
+        module_name = solver_cls.__module__
+        if module_name not in import_costs:
+            import_costs[module_name] = import_cost(module_name)
+
+        for n_obj, n_dim, iters in itertools.product(n_bodies, n_dims, n_iters):
+            test_case = make_test_case(n_obj, n_dim)
+            solver, setup = construction_cost(solver_cls, InitData(dt, iters), test_case)
+            setup["import"] = import_costs[module_name]
+
+            solve = measure(solver.solve, warmup=warmup, repeats=repeats, **test_case.__dict__)
+            setup["first_solve_overhead"] = setup["first_solve"] - solve.median
+            record = {
+                "solver" : name,
+                "n_bodies" : n_obj,
+                "n_dim" : n_dim,
+                "n_iters" : iters,
+                "setup" : setup,
+                "solve" : asdict(solve),
+                "peak_memory" : peak_memory(solver.solve, **test_case.__dict__) if memory else None,
+            }
+            results.append(record)
+            print(f"{name} : N={n_obj} dim={n_dim} iters={iters} : median {solve.median:.4g} s (IQR {solve.spread:.2g} s)")
+
+            if hasattr(solver, "close"):
+                solver.close()
+
+    return {
+        "meta" : {
+            "timestamp" : datetime.datetime.now().isoformat(),
+            "host" : platform.node(),
+            "platform" : platform.platform(),
+            "python" : platform.python_version(),
+            "numpy" : np.__version__,
+            "warmup" : warmup,
+            "repeats" : repeats,
+        },
+        "results" : results,
+    }
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def result_key(record):
+    return (record["solver"], record["n_bodies"], record["n_dim"], record["n_iters"])
+
+def compare(baseline, current, threshold=0.1):
+    baseline = {result_key(r) : r for r in baseline["results"]}
+    regressions = []
+    for record in current["results"]:
+        key = result_key(record)
+        if key not in baseline:
+            continue
+        old, new = baseline[key]["solve"], record["solve"]
+        ratio = new["median"] / old["median"]
+        # slower by more than the threshold and by more than the run-to-run noise
+        noise = (old["q3"] - old["q1"]) + (new["q3"] - new["q1"])
+        regressed = ratio > 1 + threshold and new["median"] - old["median"] > noise
+        if regressed:
+            regressions.append((key, ratio))
+        flag = "REGRESSION" if regressed else ""
+        print(f"{key[0]} : N={key[1]} dim={key[2]} iters={key[3]} : {old['median']:.4g} s -> {new['median']:.4g} s ({ratio:.2f}x) {flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="n-body solver benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--solvers", nargs="+", default=["python", "cython", "multiprocessing", "opencl"], choices=list(BACKENDS))
+    run_parser.add_argument("--n-bodies", nargs="+", type=int, default=[50, 100, 200])
+    run_parser.add_argument("--n-dim", nargs="+", type=int, default=[2])
+    run_parser.add_argument("--n-iters", nargs="+", type=int, default=[100])
+    run_parser.add_argument("--dt", type=float, default=1.5 * 10 ** 7)
+    run_parser.add_argument("--warmup", type=int, default=1)
+    run_parser.add_argument("--repeats", type=int, default=5)
+    run_parser.add_argument("--no-memory", action="store_true")
+    run_parser.add_argument("--out", default="benchmark.json")
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        solver_classes = {name : load_backend(name) for name in args.solvers}
+        results = run(
+            solver_classes, args.n_bodies, args.n_dim, args.n_iters, args.dt,
+            args.warmup, args.repeats, not args.no_memory
+        )
+        save(results, args.out)
+        return 0
+
+    regressions = compare(load(args.baseline), load(args.current), args.threshold)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+import trajectory
+
+@dataclass
+class Checkpoint:
+    step : int
+    r : np.ndarray
+    v : np.ndarray
+    a : np.ndarray
+    m : np.ndarray
+    dt : float
+    G : float
+
+def save(checkpoint, path):
+    # write next to the target and rename, so a kill mid-write leaves the
+    # previous checkpoint intact
+    tmp_path = path + ".tmp"
+    arrays = {"r" : checkpoint.r, "v" : checkpoint.v, "m" : checkpoint.m}
+    if checkpoint.a is not None:
+        arrays["a"] = checkpoint.a
+    with open(tmp_path, "wb") as f:
+        np.savez(f, step=checkpoint.step, dt=checkpoint.dt, G=checkpoint.G, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load(path):
+    with np.load(path) as data:
+        return Checkpoint(
+            int(data["step"]),
+            data["r"], data["v"], data["a"] if "a" in data else None, data["m"],
+            float(data["dt"]), float(data["G"])
+        )
+
+def checkpointed(solver, states, m, path, checkpoint_every, every):
+    state = None
+    for i, r, v, a in states:
+        state = (i, r, v, a)
+        if checkpoint_every and i % checkpoint_every == 0:
+            save(Checkpoint(i, r, v, a, m, solver.dt, solver.G), path)
+        if i % every == 0:
+            yield r
+
+    # always leave the final state behind so the run can be extended
+    if state is not None:
+        i, r, v, a = state
+        save(Checkpoint(i, r, v, a, m, solver.dt, solver.G), path)
+
+def stream(solver, r_0, v_0, m_0, path, checkpoint_every=1000, every=1):
+    save(Checkpoint(0, np.asarray(r_0), np.asarray(v_0), None, np.asarray(m_0), solver.dt, solver.G), path)
+    yield r_0
+    yield from checkpointed(solver, solver.steps(r_0, v_0, None, m_0, 1, solver.n_iters), m_0, path, checkpoint_every, every)
+
+def resume_stream(solver, checkpoint, extra_iters, path=None, checkpoint_every=1000, every=1):
+    if (solver.dt, solver.G) != (checkpoint.dt, checkpoint.G):
+        raise ValueError(f"checkpoint was written with dt={checkpoint.dt}, G={checkpoint.G}, solver has dt={solver.dt}, G={solver.G}")
+
+    start = checkpoint.step + 1
+    states = solver.steps(checkpoint.r, checkpoint.v, checkpoint.a, checkpoint.m, start, start + extra_iters)
+    if path is None:
+        return (r for i, r, _, _ in states if i % every == 0)
+    return checkpointed(solver, states, checkpoint.m, path, checkpoint_every, every)
+
+def solve(solver, r_0, v_0, m_0, path, checkpoint_every=1000):
+    R = np.empty((solver.n_iters,) + np.shape(r_0), dtype=getattr(solver, "dtype", np.float64))
+    return trajectory.collect(stream(solver, r_0, v_0, m_0, path, checkpoint_every), R)
+
+def resume(solver, checkpoint, extra_iters, path=None, checkpoint_every=1000):
+    if isinstance(checkpoint, str):
+        path = path or checkpoint
+        checkpoint = load(checkpoint)
+    R = np.empty((extra_iters,) + checkpoint.r.shape, dtype=getattr(solver, "dtype", np.float64))
+    return trajectory.collect(resume_stream(solver, checkpoint, extra_iters, path, checkpoint_every), R)
@@ -1,41 +1,47 @@
-
-import numpy as np
-cimport numpy as np
-
 cdef class CythonSolver:
 
-    cdef double dt
-    cdef int n_iters
-    cdef double G
+    cdef public double dt
+    cdef public int n_iters
+    cdef public double G
+    cdef public object dtype
+    cdef public list observers
+    cdef bint single
 
     cpdef r_step(
         CythonSolver self,
-        np.ndarray[np.float64_t, ndim=2] r, 
-        np.ndarray[np.float64_t, ndim=2] v, 
-        np.ndarray[np.float64_t, ndim=2] a, 
+        double[:, ::1] r,
+        double[:, ::1] v,
+        double[:, ::1] a,
         double dt
     )
 
     cpdef v_step(
         CythonSolver self,
-        np.ndarray[np.float64_t, ndim=2] v, 
-        np.ndarray[np.float64_t, ndim=2] a, 
-        np.ndarray[np.float64_t, ndim=2] next_a, 
+        double[:, ::1] v,
+        double[:, ::1] a,
+        double[:, ::1] next_a,
         double dt
     )
 
     cpdef acceleration(
         CythonSolver self,
-        np.ndarray[np.float64_t, ndim=2] r_i,
-        np.ndarray[np.float64_t, ndim=1] m_i,
-        np.ndarray[np.float64_t, ndim=2] r_j,
-        np.ndarray[np.float64_t, ndim=1] m_j,
+        double[:, ::1] r_i,
+        double[::1] m_i,
+        double[:, ::1] r_j,
+        double[::1] m_j,
         double G
     )
 
     cpdef solve(
         CythonSolver self,
-        np.ndarray[np.float64_t, ndim=2] r_0, 
-        np.ndarray[np.float64_t, ndim=2] v_0, 
-        np.ndarray[np.float64_t, ndim=1] m_0
-    )
\ No newline at end of file
+        r_0,
+        v_0,
+        m_0
+    )
+
+    cpdef solve_batch(
+        CythonSolver self,
+        r_0,
+        v_0,
+        m_0
+    )
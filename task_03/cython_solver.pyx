@@ -1,69 +1,394 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
 import numpy as np
-cimport numpy as np
 import cython
+from cython.parallel cimport prange
+from libc.math cimport sqrt, sqrtf
+
+import trajectory
+
+# trajectories and the pairwise math are `real`, forces and the integrator state
+# (r, v, a) are always accumulated in double. Each step the pair loop reads a `real`
+# copy of the positions; in single precision it is taken in power-of-two units of
+# length and mass so |r_ij| ** 3 stays in float range, and G and the units are
+# applied to the double sums
+ctypedef fused real:
+    float
+    double
+
+DEF MAX_DIM = 8
+DEF TILE = 256
+
+cdef inline void accelerate_body(
+    real[:, ::1] r_i,
+    real[:, ::1] r_j,
+    real[::1] m_j,
+    double factor,
+    double[:, ::1] out,
+    Py_ssize_t i
+    ) noexcept nogil:
+    # positions are (n_dim, n_bodies), so every pass over a tile of j bodies is a
+    # plain loop over contiguous `real`s the compiler can vectorize
+    cdef Py_ssize_t lo, j, d, n
+    cdef Py_ssize_t n_dim = r_i.shape[0]
+    cdef real x, dx, norm
+    cdef double s0, s1, s2, s3
+    cdef real w[TILE]
+    cdef double acc[MAX_DIM]
+
+    for d in range(n_dim):
+        acc[d] = 0
+    for lo in range(0, r_j.shape[1], TILE):
+        n = min(TILE, r_j.shape[1] - lo)
+        for j in range(n):
+            w[j] = 0
+        for d in range(n_dim):
+            x = r_i[d, i]
+            for j in range(n):
+                dx = r_j[d, lo + j] - x
+                w[j] = w[j] + dx * dx
+        # w = m / |r_ij| ** 3; coincident bodies get a finite w times a zero separation
+        for j in range(n):
+            norm = w[j] + (w[j] == 0)
+            if real is float:
+                w[j] = m_j[lo + j] / (norm * sqrtf(norm))
+            else:
+                w[j] = m_j[lo + j] / (norm * sqrt(norm))
+        # pair terms are summed in double, four independent partial sums keep the
+        # additions from waiting on each other
+        for d in range(n_dim):
+            x = r_i[d, i]
+            s0 = s1 = s2 = s3 = 0
+            j = 0
+            while j + 4 <= n:
+                s0 = s0 + <double>(w[j] * (r_j[d, lo + j] - x))
+                s1 = s1 + <double>(w[j + 1] * (r_j[d, lo + j + 1] - x))
+                s2 = s2 + <double>(w[j + 2] * (r_j[d, lo + j + 2] - x))
+                s3 = s3 + <double>(w[j + 3] * (r_j[d, lo + j + 3] - x))
+                j = j + 4
+            while j < n:
+                s0 = s0 + <double>(w[j] * (r_j[d, lo + j] - x))
+                j = j + 1
+            acc[d] = acc[d] + (s0 + s1) + (s2 + s3)
+    for d in range(n_dim):
+        out[i, d] = acc[d] * factor
+
+cdef void accelerate(
+    real[:, ::1] r_i,
+    real[:, ::1] r_j,
+    real[::1] m_j,
+    double factor,
+    double[:, ::1] out
+    ) noexcept nogil:
+    cdef Py_ssize_t i
+
+    for i in prange(r_i.shape[1], schedule="static"):
+        accelerate_body(r_i, r_j, m_j, factor, out, i)
+
+cdef void store_scaled(
+    double[:, ::1] r,
+    double scale,
+    real[:, ::1] out
+    ) noexcept nogil:
+    cdef Py_ssize_t i, d
+
+    for i in prange(r.shape[0], schedule="static"):
+        for d in range(r.shape[1]):
+            out[d, i] = <real>(r[i, d] * scale)
+
+def unit(x):
+    return 2.0 ** np.round(np.log2(x)) if x > 0 else 1.0
+
+def pair_units(r, m, G, dtype):
+    # (position scale, masses in pair precision, factor back to SI accelerations)
+    if np.shape(r)[1] > MAX_DIM:
+        raise ValueError(f"at most {MAX_DIM} dimensions are supported, got {np.shape(r)[1]}")
+    if dtype == np.float64:
+        return 1.0, np.ascontiguousarray(m, dtype=np.float64), G
+    length = unit(np.max(np.ptp(r, axis=0)) if len(r) else 0)
+    mass = unit(np.max(np.abs(m)) if len(m) else 0)
+    return 1 / length, np.ascontiguousarray(np.asarray(m) / mass, dtype=dtype), G * mass / length ** 2
+
+cdef void store(
+    double[:, ::1] r,
+    real[:, ::1] out
+    ) noexcept nogil:
+    cdef Py_ssize_t i, d
+
+    for i in prange(r.shape[0], schedule="static"):
+        for d in range(r.shape[1]):
+            out[i, d] = <real>r[i, d]
+
+cdef void verlet_r_step(
+    double[:, ::1] r,
+    double[:, ::1] v,
+    double[:, ::1] a,
+    double dt,
+    double[:, ::1] out
+    ) noexcept nogil:
+    cdef Py_ssize_t i, d
+
+    for i in prange(r.shape[0], schedule="static"):
+        for d in range(r.shape[1]):
+            out[i, d] = r[i, d] + v[i, d] * dt + 0.5 * a[i, d] * dt * dt
+
+cdef void verlet_v_step(
+    double[:, ::1] v,
+    double[:, ::1] a,
+    double[:, ::1] next_a,
+    double dt,
+    double[:, ::1] out
+    ) noexcept nogil:
+    cdef Py_ssize_t i, d
+
+    for i in prange(v.shape[0], schedule="static"):
+        for d in range(v.shape[1]):
+            out[i, d] = v[i, d] + 0.5 * (a[i, d] + next_a[i, d]) * dt
+
+cdef void integrate(
+    real[:, :, ::1] R,
+    double[:, ::1] r,
+    double[:, ::1] v,
+    double[:, ::1] a,
+    double[:, ::1] next_a,
+    real[:, ::1] pairs_r,
+    real[::1] pairs_m,
+    double scale,
+    double factor,
+    double dt
+    ) noexcept nogil:
+    cdef Py_ssize_t i
+
+    store(r, R[0])
+    store_scaled(r, scale, pairs_r)
+    accelerate(pairs_r, pairs_r, pairs_m, factor, a)
+    for i in range(R.shape[0] - 1):
+        verlet_r_step(r, v, a, dt, r)
+        store(r, R[i + 1])
+        store_scaled(r, scale, pairs_r)
+        accelerate(pairs_r, pairs_r, pairs_m, factor, next_a)
+        verlet_v_step(v, a, next_a, dt, v)
+        a[...] = next_a
+
+cdef void integrate_system(
+    real[:, :, ::1] R,
+    double[:, ::1] r,
+    double[:, ::1] v,
+    double[:, ::1] a,
+    double[:, ::1] next_a,
+    real[:, ::1] pairs_r,
+    real[::1] pairs_m,
+    double scale,
+    double factor,
+    double dt
+    ) noexcept nogil:
+    cdef Py_ssize_t i, k, d
+    cdef Py_ssize_t n_bodies = R.shape[1]
+    cdef Py_ssize_t n_dim = R.shape[2]
+
+    for k in range(n_bodies):
+        for d in range(n_dim):
+            R[0, k, d] = <real>r[k, d]
+            pairs_r[d, k] = <real>(r[k, d] * scale)
+    for k in range(n_bodies):
+        accelerate_body(pairs_r, pairs_r, pairs_m, factor, a, k)
+
+    for i in range(R.shape[0] - 1):
+        for k in range(n_bodies):
+            for d in range(n_dim):
+                r[k, d] = r[k, d] + v[k, d] * dt + 0.5 * a[k, d] * dt * dt
+                R[i + 1, k, d] = <real>r[k, d]
+                pairs_r[d, k] = <real>(r[k, d] * scale)
+        for k in range(n_bodies):
+            accelerate_body(pairs_r, pairs_r, pairs_m, factor, next_a, k)
+        for k in range(n_bodies):
+            for d in range(n_dim):
+                v[k, d] = v[k, d] + 0.5 * (a[k, d] + next_a[k, d]) * dt
+                a[k, d] = next_a[k, d]
+
+cdef void integrate_batch(
+    real[:, :, :, ::1] R,
+    double[:, :, ::1] r,
+    double[:, :, ::1] v,
+    double[:, :, ::1] a,
+    double[:, :, ::1] next_a,
+    real[:, :, ::1] pairs_r,
+    real[:, ::1] pairs_m,
+    double[::1] scale,
+    double[::1] factor,
+    double dt
+    ) noexcept nogil:
+    cdef Py_ssize_t b
+
+    for b in prange(R.shape[0], schedule="dynamic"):
+        integrate_system(R[b], r[b], v[b], a[b], next_a[b], pairs_r[b], pairs_m[b], scale[b], factor[b], dt)
 
 cdef class CythonSolver:
 
-    def __init__(CythonSolver self, double dt, int n_iters, double G):
+    def __init__(CythonSolver self, double dt, int n_iters, double G, dtype=np.float64):
         self.dt = dt
         self.n_iters = n_iters
         self.G = G
+        self.dtype = np.dtype(dtype).type
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(f"unsupported dtype {dtype!r}, expected float32 or float64")
+        self.single = self.dtype == np.float32
+        self.observers = []
+
+    def notify(CythonSolver self, step, r, v, m):
+        for observer in self.observers:
+            observer(self, step, r, v, m)
 
     cpdef r_step(
         CythonSolver self,
-        np.ndarray[np.float64_t, ndim=2] r, 
-        np.ndarray[np.float64_t, ndim=2] v, 
-        np.ndarray[np.float64_t, ndim=2] a, 
+        double[:, ::1] r,
+        double[:, ::1] v,
+        double[:, ::1] a,
         double dt
         ):
-        return r + v * dt + 0.5 * a * dt * dt
+        out = np.empty((r.shape[0], r.shape[1]))
+        cdef double[:, ::1] out_view = out
+        with nogil:
+            verlet_r_step(r, v, a, dt, out_view)
+        return out
 
     cpdef v_step(
         CythonSolver self,
-        np.ndarray[np.float64_t, ndim=2] v, 
-        np.ndarray[np.float64_t, ndim=2] a, 
-        np.ndarray[np.float64_t, ndim=2] next_a, 
+        double[:, ::1] v,
+        double[:, ::1] a,
+        double[:, ::1] next_a,
         double dt
         ):
-        return v + 0.5 * (a + next_a) * dt
+        out = np.empty((v.shape[0], v.shape[1]))
+        cdef double[:, ::1] out_view = out
+        with nogil:
+            verlet_v_step(v, a, next_a, dt, out_view)
+        return out
 
     cpdef acceleration(
         CythonSolver self,
-        np.ndarray[np.float64_t, ndim=2] r_i,
-        np.ndarray[np.float64_t, ndim=1] m_i,
-        np.ndarray[np.float64_t, ndim=2] r_j,
-        np.ndarray[np.float64_t, ndim=1] m_j,
+        double[:, ::1] r_i,
+        double[::1] m_i,
+        double[:, ::1] r_j,
+        double[::1] m_j,
         double G
-    ):
-        cdef np.ndarray[np.float64_t, ndim=3] r_ij = r_j - r_i[:, None]
-
-        cdef np.ndarray[np.float64_t, ndim=3] f_m_denom = np.linalg.norm(r_ij, axis=2)[...,None] ** 3
-        cdef np.ndarray[np.float64_t, ndim=3] f_m = G * m_j[:, None] * np.divide(r_ij, f_m_denom, out=np.zeros_like(r_ij), where=f_m_denom!=0)
+        ):
+        out = np.empty((r_i.shape[0], r_i.shape[1]))
+        cdef double[:, ::1] out_view = out
+        cdef float[:, ::1] r_i_single, r_j_single
+        cdef float[::1] m_j_single
+        cdef double factor
 
-        return np.sum(f_m, axis=1)
+        scale, m_j_pairs, factor = pair_units(r_j, m_j, G, self.dtype)
+        r_i_pairs = np.ascontiguousarray(np.asarray(r_i).T * scale, dtype=self.dtype)
+        r_j_pairs = np.ascontiguousarray(np.asarray(r_j).T * scale, dtype=self.dtype)
+        if self.single:
+            r_i_single, r_j_single, m_j_single = r_i_pairs, r_j_pairs, m_j_pairs
+            with nogil:
+                accelerate(r_i_single, r_j_single, m_j_single, factor, out_view)
+        else:
+            r_i, r_j, m_j = r_i_pairs, r_j_pairs, m_j_pairs
+            with nogil:
+                accelerate(r_i, r_j, m_j, factor, out_view)
+        return out
 
     cpdef solve(
         CythonSolver self,
-        np.ndarray[np.float64_t, ndim=2] r_0, 
-        np.ndarray[np.float64_t, ndim=2] v_0, 
-        np.ndarray[np.float64_t, ndim=1] m_0
+        r_0,
+        v_0,
+        m_0
         ):
-        cdef tuple result_shape = (self.n_iters, int(r_0.shape[0]) , 2)
-        cdef np.ndarray[np.float64_t, ndim=3] R = np.zeros(result_shape)
-        cdef np.ndarray[np.float64_t, ndim=3] V = R.copy()
-        cdef np.ndarray[np.float64_t, ndim=3] A = R.copy()
+        R = np.empty((self.n_iters,) + np.shape(r_0), dtype=self.dtype)
+        if self.observers:
+            # observers need every step, so skip the single nogil loop
+            return trajectory.collect(self.stream(r_0, v_0, m_0), R)
+        cdef float[:, :, ::1] R_single
+        cdef double[:, :, ::1] R_double
+        cdef float[:, ::1] pairs_r_single
+        cdef double[:, ::1] pairs_r_double
+        cdef float[::1] pairs_m_single
+        cdef double[::1] pairs_m_double
+        cdef double[:, ::1] r = np.array(r_0, dtype=np.float64, order="C")
+        cdef double[:, ::1] v = np.array(v_0, dtype=np.float64, order="C")
+        cdef double[:, ::1] a = np.empty_like(v)
+        cdef double[:, ::1] next_a = np.empty_like(v)
+        cdef double scale, factor
 
-        R[0] = r_0
-        V[0] = v_0
-        A[0] = self.acceleration(r_0, m_0, r_0, m_0, self.G)
+        scale, pairs_m, factor = pair_units(r, m_0, self.G, self.dtype)
+        pairs_r = np.empty(np.shape(r)[::-1], dtype=self.dtype)
+        if self.single:
+            R_single, pairs_r_single, pairs_m_single = R, pairs_r, pairs_m
+            with nogil:
+                integrate(R_single, r, v, a, next_a, pairs_r_single, pairs_m_single, scale, factor, self.dt)
+        else:
+            R_double, pairs_r_double, pairs_m_double = R, pairs_r, pairs_m
+            with nogil:
+                integrate(R_double, r, v, a, next_a, pairs_r_double, pairs_m_double, scale, factor, self.dt)
 
-        for i in range(self.n_iters - 1):
-            R[i + 1] = self.r_step(R[i], V[i], A[i], self.dt)
-            A[i + 1] = self.acceleration(R[i + 1], m_0, R[i + 1], m_0, self.G)
-            V[i + 1] = self.v_step(V[i], A[i], A[i + 1], self.dt)
+        return R
+
+    cpdef solve_batch(
+        CythonSolver self,
+        r_0,
+        v_0,
+        m_0
+        ):
+        n_batch, n_bodies, n_dim = np.shape(r_0)
+        R = np.empty((n_batch, self.n_iters, n_bodies, n_dim), dtype=self.dtype)
+        cdef float[:, :, :, ::1] R_single
+        cdef double[:, :, :, ::1] R_double
+        cdef float[:, :, ::1] pairs_r_single
+        cdef double[:, :, ::1] pairs_r_double
+        cdef float[:, ::1] pairs_m_single
+        cdef double[:, ::1] pairs_m_double
+        cdef double[:, :, ::1] r = np.array(r_0, dtype=np.float64, order="C")
+        cdef double[:, :, ::1] v = np.array(v_0, dtype=np.float64, order="C")
+        cdef double[:, :, ::1] a = np.empty_like(v)
+        cdef double[:, :, ::1] next_a = np.empty_like(v)
+
+        units = [pair_units(r[b], m_0[b], self.G, self.dtype) for b in range(n_batch)]
+        cdef double[::1] scale = np.array([u[0] for u in units])
+        cdef double[::1] factor = np.array([u[2] for u in units])
+        pairs_m = np.stack([u[1] for u in units])
+        pairs_r = np.empty((n_batch, n_dim, n_bodies), dtype=self.dtype)
+        if self.single:
+            R_single, pairs_r_single, pairs_m_single = R, pairs_r, pairs_m
+            with nogil:
+                integrate_batch(R_single, r, v, a, next_a, pairs_r_single, pairs_m_single, scale, factor, self.dt)
+        else:
+            R_double, pairs_r_double, pairs_m_double = R, pairs_r, pairs_m
+            with nogil:
+                integrate_batch(R_double, r, v, a, next_a, pairs_r_double, pairs_m_double, scale, factor, self.dt)
 
         return R
 
+    def steps(CythonSolver self, r, v, a, m, int start, int stop):
+        r = np.ascontiguousarray(r, dtype=np.float64)
+        v = np.ascontiguousarray(v, dtype=np.float64)
+        m = np.ascontiguousarray(m, dtype=np.float64)
+        if a is None:
+            a = self.acceleration(r, m, r, m, self.G)
+        else:
+            a = np.ascontiguousarray(a, dtype=np.float64)
+
+        for i in range(start, stop):
+            r = self.r_step(r, v, a, self.dt)
+            next_a = self.acceleration(r, m, r, m, self.G)
+            v = self.v_step(v, a, next_a, self.dt)
+            a = next_a
+            self.notify(i, r, v, m)
+            yield i, r, v, a
+
+    def stream(CythonSolver self, r_0, v_0, m_0, int every=1):
+        r = np.ascontiguousarray(r_0, dtype=np.float64)
+        m_0 = np.ascontiguousarray(m_0, dtype=np.float64)
+        a = self.acceleration(r, m_0, r, m_0, self.G)
+        self.notify(0, r, v_0, m_0)
+        yield r
+
+        for i, r, _, _ in self.steps(r, v_0, a, m_0, 1, self.n_iters):
+            if i % every == 0:
+                yield r
+
 #     dt : float
 #     n_iters : int
 #     G : float = 6.6743 * 10 ** -11
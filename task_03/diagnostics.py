@@ -0,0 +1,106 @@
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+SERIES_DTYPE = np.dtype([
+    ("step", np.int64),
+    ("step_time", np.float64),
+    ("kinetic", np.float64),
+    ("potential", np.float64),
+    ("energy", np.float64),
+    ("energy_drift", np.float64),
+    ("momentum_drift", np.float64),
+    ("angular_momentum_drift", np.float64),
+])
+
+class ConservationError(RuntimeError):
+
+    def __init__(self, step, drift, r, v):
+        super().__init__(f"relative energy drift {drift:.3e} at step {step}")
+        self.step = step
+        self.drift = drift
+        self.r = r
+        self.v = v
+
+def kinetic_energy(v, m):
+    return 0.5 * np.dot(m, np.einsum("id,id->i", v, v))
+
+def potential_energy(r, m, G, tile_size=128):
+    # row tiles keep the pairwise buffer at tile_size * N instead of N * N
+    energy = 0.0
+    for lo in range(0, r.shape[0], tile_size):
+        hi = min(lo + tile_size, r.shape[0])
+        norm = np.linalg.norm(r[lo:hi, None] - r[None], axis=2)
+        inv = np.divide(1, norm, out=np.zeros_like(norm), where=norm!=0)
+        energy -= m[lo:hi] @ inv @ m
+    return 0.5 * G * energy
+
+def momentum(v, m):
+    return m @ v
+
+def specific_angular_momentum(r, v):
+    if r.shape[1] == 2:
+        return (r[:, 0] * v[:, 1] - r[:, 1] * v[:, 0])[:, None]
+    return np.cross(r, v)
+
+@dataclass
+class ConservationMonitor:
+    every : int = 1
+    max_energy_drift : float = None
+    tile_size : int = 128
+    records : list = field(default_factory=list, init=False, repr=False)
+
+    def __post_init__(self):
+        self.reference = None
+        self.last_step = None
+        self.last_time = None
+
+    def reset(self):
+        self.records = []
+        self.reference = None
+        self.last_step = None
+
+    def __call__(self, solver, step, r, v, m):
+        if step % self.every:
+            return
+        start = time.perf_counter()
+        r = np.asarray(r, dtype=np.float64)
+        v = np.asarray(v, dtype=np.float64)
+        m = np.asarray(m, dtype=np.float64)
+
+        kinetic = kinetic_energy(v, m)
+        potential = potential_energy(r, m, solver.G, self.tile_size)
+        energy = kinetic + potential
+        h = specific_angular_momentum(r, v)
+        p = momentum(v, m)
+        l = m @ h
+
+        if self.reference is None:
+            # drifts of quantities that start near zero are measured against
+            # the total magnitude instead of the initial value
+            p_scale = np.sum(m * np.linalg.norm(v, axis=1))
+            l_scale = np.sum(m * np.linalg.norm(h, axis=1))
+            self.reference = (energy, p, l, abs(energy) or 1.0, p_scale or 1.0, l_scale or 1.0)
+        energy_0, p_0, l_0, e_scale, p_scale, l_scale = self.reference
+
+        step_time = np.nan
+        if self.last_step is not None and step > self.last_step:
+            step_time = (start - self.last_time) / (step - self.last_step)
+
+        drift = abs(energy - energy_0) / e_scale
+        self.records.append((
+            step, step_time, kinetic, potential, energy, drift,
+            np.linalg.norm(p - p_0) / p_scale,
+            np.linalg.norm(l - l_0) / l_scale,
+        ))
+
+        self.last_step = step
+        # the monitor's own cost is left out of the step time
+        self.last_time = time.perf_counter()
+        if self.max_energy_drift is not None and drift > self.max_energy_drift:
+            raise ConservationError(step, drift, r, v)
+
+    @property
+    def series(self):
+        return np.array(self.records, dtype=SERIES_DTYPE)
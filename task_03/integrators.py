@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+import numpy as np
+
+import python_solvers
+import trajectory
+
+@dataclass
+class Scheme:
+    name : str
+    order : int
+    ops : tuple
+
+def compose_leapfrog(weights):
+    ops = []
+    for w in weights:
+        if ops and ops[-1][0] == "kick":
+            ops[-1] = ("kick", ops[-1][1] + w / 2)
+        else:
+            ops.append(("kick", w / 2))
+        ops.append(("drift", w))
+        ops.append(("kick", w / 2))
+    return tuple(ops)
+
+def compose_position_verlet(weights):
+    ops = []
+    for w in weights:
+        if ops and ops[-1][0] == "drift":
+            ops[-1] = ("drift", ops[-1][1] + w / 2)
+        else:
+            ops.append(("drift", w / 2))
+        ops.append(("kick", w))
+        ops.append(("drift", w / 2))
+    return tuple(ops)
+
+def triple_jump(order):
+    w_1 = 1 / (2 - 2 ** (1 / (order + 1)))
+    return w_1, 1 - 2 * w_1
+
+YOSHIDA4_W1, YOSHIDA4_W0 = triple_jump(2)
+YOSHIDA6_W = (0.784513610477560, 0.235573213359357, -1.17767998417887)
+YOSHIDA6_W0 = 1 - 2 * sum(YOSHIDA6_W)
+
+SCHEMES = {
+    "leapfrog" : Scheme("leapfrog", 2, compose_leapfrog([1.0])),
+    "forest-ruth" : Scheme("forest-ruth", 4, compose_position_verlet([YOSHIDA4_W1, YOSHIDA4_W0, YOSHIDA4_W1])),
+    "yoshida4" : Scheme("yoshida4", 4, compose_leapfrog([YOSHIDA4_W1, YOSHIDA4_W0, YOSHIDA4_W1])),
+    "yoshida6" : Scheme("yoshida6", 6, compose_leapfrog([*YOSHIDA6_W, YOSHIDA6_W0, *YOSHIDA6_W[::-1]])),
+}
+
+@dataclass
+class SymplecticSolver:
+    dt : float
+    n_iters : int
+    G : float = 6.6743 * 10 ** -11
+    scheme : str = "yoshida4"
+    backend : object = None
+    dtype : type = np.float64
+
+    def __post_init__(self):
+        if self.scheme not in SCHEMES:
+            raise ValueError(f"unknown scheme {self.scheme!r}, expected one of {list(SCHEMES)}")
+        if self.backend is None:
+            self.backend = python_solvers.PythonVerletSolver(self.dt, self.n_iters, self.G, self.dtype)
+        self.n_force_evals = 0
+
+    def acceleration(self, r, m):
+        self.n_force_evals += 1
+        return self.backend.acceleration(r, m, r, m, self.G)
+
+    def steps(self, r, v, a, m, start, stop):
+        ops = SCHEMES[self.scheme].ops
+        r = np.array(r, dtype=np.float64)
+        v = np.array(v, dtype=np.float64)
+        m = np.ascontiguousarray(m, dtype=np.float64)
+
+        # a stays valid until the next drift, so kick-first schemes reuse the
+        # last force evaluation of the previous step
+        for i in range(start, stop):
+            for op, coef in ops:
+                if op == "drift":
+                    r = r + coef * self.dt * v
+                    a = None
+                else:
+                    if a is None:
+                        a = self.acceleration(r, m)
+                    v = v + coef * self.dt * a
+            yield i, r, v, a
+
+    def stream(self, r_0, v_0, m_0, every=1):
+        r = np.array(r_0, dtype=np.float64)
+        self.n_force_evals = 0
+
+        yield r
+        for i, r, _, _ in self.steps(r, v_0, None, m_0, 1, self.n_iters):
+            if i % every == 0:
+                yield r
+
+    def solve(self, r_0, v_0, m_0):
+        R = np.empty((self.n_iters,) + np.shape(r_0), dtype=self.dtype)
+        return trajectory.collect(self.stream(r_0, v_0, m_0), R)
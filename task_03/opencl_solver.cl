@@ -1,57 +1,94 @@
-__kernel void solve(__global double *R, __global double *V,
-                              __global double *A, __global double *m,
-                              const double G,
-                              const double dt, const unsigned n_bodies,
-                              const unsigned n_dim, const unsigned n_iters,
-                              __local double *localmem) {
-  int global_idx = get_global_id(0);
-
-  for (int jb = 0; jb < n_bodies; jb++) {
-    if (jb == global_idx) continue;
-    double tmp[N_DIM];
-    double norm = 0;
-    for (size_t d=0; d < n_dim; d++) {
-      tmp[d] = R[jb * n_dim + d] - R[global_idx * n_dim + d];
-      norm += tmp[d] * tmp[d];
-    }
-    norm = rsqrt(norm);
-    norm = norm * norm * norm;
-    double f = G * norm * m[jb];
-    for (size_t d=0; d < n_dim; d++) {
-      A[global_idx * n_dim + d] += f * tmp[d];
-    }
-  }
-  barrier(CLK_GLOBAL_MEM_FENCE);
+// REAL is the type of the pairwise math; the integrator state and the force sums
+// are double.
+//
+// Positions and masses enter the pair loop in power-of-two units (scale, and the
+// scaled masses in m), so |r_ij| ** 3 stays in float range; factor = G * mass unit
+// / length unit ** 2 brings the sums back to SI accelerations.
+void tiled_acceleration(__global const double *r, __global const REAL *m,
+                        const double scale, const double factor, const unsigned n_bodies,
+                        __local REAL *tile_r, __local REAL *tile_m,
+                        const REAL *r_i, double *acc) {
+  size_t local_idx = get_local_id(0);
+  size_t group_size = get_local_size(0);
 
-  for (int i=1; i < n_iters; i++) {
-    size_t cur = n_bodies * n_dim * i;
-    size_t prev = n_bodies * n_dim * (i - 1);
+  for (size_t d = 0; d < N_DIM; d++) {
+    acc[d] = 0;
+  }
 
-    for (size_t d=0; d < n_dim; d++) {
-      R[cur + global_idx * n_dim + d] = R[prev + global_idx * n_dim + d] + dt * V[prev + global_idx * n_dim + d] + 0.5 * dt * dt * A[prev + global_idx * n_dim + d];  
+  for (size_t tile = 0; tile < n_bodies; tile += group_size) {
+    size_t jb = tile + local_idx;
+    for (size_t d = 0; d < N_DIM; d++) {
+      tile_r[local_idx * N_DIM + d] = jb < n_bodies ? (REAL)(r[jb * N_DIM + d] * scale) : 0;
     }
-    barrier(CLK_GLOBAL_MEM_FENCE);
-
-    for (int jb = 0; jb < n_bodies; jb++) {
-      if (jb == global_idx) continue;
-      double tmp[N_DIM];
-      double norm = 0;
-      for (size_t d=0; d < n_dim; d++) {
-        tmp[d] = R[cur + jb * n_dim + d] - R[cur + global_idx * n_dim + d];
+    tile_m[local_idx] = jb < n_bodies ? m[jb] : 0;
+    barrier(CLK_LOCAL_MEM_FENCE);
+
+    size_t tile_len = min(group_size, (size_t)(n_bodies - tile));
+    for (size_t j = 0; j < tile_len; j++) {
+      REAL tmp[N_DIM];
+      REAL norm = 0;
+      for (size_t d = 0; d < N_DIM; d++) {
+        tmp[d] = tile_r[j * N_DIM + d] - r_i[d];
         norm += tmp[d] * tmp[d];
       }
-      norm = rsqrt(norm);
-      norm = norm * norm * norm;
-      double f = G * norm * m[jb];
-      for (size_t d=0; d < n_dim; d++) {
-        A[cur + global_idx * n_dim + d] += f * tmp[d];
+      // coincident bodies have tmp == 0, any finite w leaves them out
+      norm += norm == 0;
+      REAL w = tile_m[j] / (norm * sqrt(norm));
+      for (size_t d = 0; d < N_DIM; d++) {
+        acc[d] += w * tmp[d];
       }
     }
-    barrier(CLK_GLOBAL_MEM_FENCE);
+    barrier(CLK_LOCAL_MEM_FENCE);
+  }
+
+  for (size_t d = 0; d < N_DIM; d++) {
+    acc[d] *= factor;
+  }
+}
+
+__kernel void acceleration(__global const double *r, __global const REAL *m,
+                           __global double *a,
+                           const double scale, const double factor, const unsigned n_bodies,
+                           __local REAL *tile_r, __local REAL *tile_m) {
+  size_t global_idx = get_global_id(0);
+  int active = global_idx < n_bodies;
 
-    for (size_t d=0; d < n_dim; d++) {
-      V[cur + global_idx * n_dim + d] = V[prev + global_idx * n_dim + d] + 0.5* dt * (A[prev + global_idx * n_dim + d] + A[cur + global_idx * n_dim + d]);
+  REAL r_i[N_DIM];
+  double acc[N_DIM];
+  for (size_t d = 0; d < N_DIM; d++) {
+    r_i[d] = active ? (REAL)(r[global_idx * N_DIM + d] * scale) : 0;
+  }
+  tiled_acceleration(r, m, scale, factor, n_bodies, tile_r, tile_m, r_i, acc);
+
+  if (!active) return;
+  for (size_t d = 0; d < N_DIM; d++) {
+    a[global_idx * N_DIM + d] = acc[d];
+  }
+}
+
+__kernel void verlet_step(__global const double *r, __global double *r_next,
+                          __global double *v, __global double *a,
+                          __global const REAL *m,
+                          const double scale, const double factor, const double dt,
+                          const unsigned n_bodies, const int first,
+                          __local REAL *tile_r, __local REAL *tile_m) {
+  size_t global_idx = get_global_id(0);
+  int active = global_idx < n_bodies;
+
+  REAL r_i[N_DIM];
+  double acc[N_DIM];
+  for (size_t d = 0; d < N_DIM; d++) {
+    r_i[d] = active ? (REAL)(r[global_idx * N_DIM + d] * scale) : 0;
+  }
+  tiled_acceleration(r, m, scale, factor, n_bodies, tile_r, tile_m, r_i, acc);
+
+  if (!active) return;
+  for (size_t d = 0; d < N_DIM; d++) {
+    size_t k = global_idx * N_DIM + d;
+    if (!first) {
+      v[k] += 0.5 * dt * (a[k] + acc[d]);
     }
-    barrier(CLK_GLOBAL_MEM_FENCE);
-  }                          
-}
\ No newline at end of file
+    a[k] = acc[d];
+    r_next[k] = r[k] + dt * v[k] + 0.5 * dt * dt * acc[d];
+  }
+}
@@ -1,44 +1,159 @@
-from dataclasses import dataclass
+import os
+from dataclasses import dataclass, field
 import numpy as np
 import pyopencl as cl
 
+import trajectory
+
+KERNEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opencl_solver.cl")
+program_cache = {}
+
+C_TYPES = {np.float32 : "float", np.float64 : "double"}
+
+def build_program(ctx, n_dim, real=np.float64):
+    key = (ctx.int_ptr, n_dim, real)
+    if key not in program_cache:
+        defines = [
+            "#pragma OPENCL EXTENSION cl_khr_fp64 : enable",
+            f"#define N_DIM {n_dim}",
+            f"#define REAL {C_TYPES[real]}"
+        ]
+        with open(KERNEL_PATH) as f:
+            source = "\n".join(defines) + "\n" + f.read()
+        program_cache[key] = cl.Program(ctx, source).build()
+    return program_cache[key]
+
 @dataclass
 class OpenCLSolver:
     dt : float
     n_iters : int
     G : float = 6.6743 * 10 ** -11
-    group_size : int = 1
+    group_size : int = 64
+    dtype : type = np.float64
+    observers : list = field(default_factory=list, repr=False, compare=False)
 
     def __post_init__(self):
         platform = cl.get_platforms()[0]
         device = platform.get_devices()[0]
         self.ctx = cl.Context([device])
-        self.queue = cl.CommandQueue(self.ctx)        
+        self.queue = cl.CommandQueue(self.ctx)
+        self.kernels = {}
+
+        self.dtype = np.dtype(self.dtype).type
+        if self.dtype not in C_TYPES:
+            raise ValueError(f"unsupported dtype {self.dtype!r}, expected float32 or float64")
+        # the integrator state and the force sums are double even in float32 mode;
+        # float state alone drifts well past the float32 tolerance
+        if "cl_khr_fp64" not in device.extensions:
+            raise ValueError(f"{device.name} has no double precision support")
+
+    @staticmethod
+    def unit(x):
+        return 2.0 ** np.round(np.log2(x)) if x > 0 else 1.0
+
+    def pair_units(self, r, m, G):
+        # (position scale, masses in pair precision, factor back to SI accelerations);
+        # in float32 the pair loop works in power-of-two units close to the system size
+        # and the largest mass so that |r_ij| ** 3 stays in range
+        if self.dtype == np.float64:
+            return 1.0, np.ascontiguousarray(m, dtype=np.float64), G
+        length = self.unit(np.max(np.ptp(r, axis=0)) if len(r) else 0)
+        mass = self.unit(np.max(np.abs(m)) if len(m) else 0)
+        return 1 / length, np.ascontiguousarray(np.asarray(m) / mass, dtype=self.dtype), G * mass / length ** 2
+
+    def notify(self, step, r, v, m):
+        for observer in self.observers:
+            observer(self, step, r, v, m)
+
+    def kernel(self, name, n_dim):
+        if (name, n_dim) not in self.kernels:
+            program = build_program(self.ctx, n_dim, self.dtype)
+            self.kernels[name, n_dim] = cl.Kernel(program, name)
+        return self.kernels[name, n_dim]
+
+    def launch_config(self, kernel, n_bodies, n_dim):
+        device = self.ctx.devices[0]
+        group_size = min(
+            self.group_size,
+            device.max_work_group_size,
+            kernel.get_work_group_info(cl.kernel_work_group_info.WORK_GROUP_SIZE, device)
+        )
+        global_size = (n_bodies + group_size - 1) // group_size * group_size
+        tiles = (
+            cl.LocalMemory(group_size * n_dim * np.dtype(self.dtype).itemsize),
+            cl.LocalMemory(group_size * np.dtype(self.dtype).itemsize)
+        )
+        return (global_size,), (group_size,), tiles
+
+    def to_device(self, array, flags):
+        hostbuf = np.ascontiguousarray(array, dtype=np.float64)
+        return cl.Buffer(self.ctx, flags | cl.mem_flags.COPY_HOST_PTR, hostbuf=hostbuf)
+
+    def acceleration(self, r_i, m_i, _r, _m, G=6.6743 * 10 ** -11):
+        n_bodies, n_dim = r_i.shape
+        kernel = self.kernel("acceleration", n_dim)
+        global_size, group_size, tiles = self.launch_config(kernel, n_bodies, n_dim)
+
+        mf = cl.mem_flags
+        scale, m, factor = self.pair_units(r_i, m_i, G)
+        r_buf = self.to_device(r_i, mf.READ_ONLY)
+        m_buf = cl.Buffer(self.ctx, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=m)
+        a = np.empty((n_bodies, n_dim), dtype=np.float64)
+        a_buf = cl.Buffer(self.ctx, mf.WRITE_ONLY, a.nbytes)
+
+        kernel(
+            self.queue, global_size, group_size, r_buf, m_buf, a_buf,
+            np.float64(scale), np.float64(factor), np.uint32(n_bodies), *tiles
+        )
+        cl.enqueue_copy(self.queue, a, a_buf)
+        return a
+
+    def stream(self, r_0, v_0, m_0, every=1):
+        n_bodies, n_dim = r_0.shape
+        kernel = self.kernel("verlet_step", n_dim)
+        global_size, group_size, tiles = self.launch_config(kernel, n_bodies, n_dim)
+
+        mf = cl.mem_flags
+        # units are fixed from the initial state, the scaling only has to keep
+        # |r_ij| ** 3 in float range
+        scale, m, factor = self.pair_units(r_0, m_0, self.G)
+        r = np.ascontiguousarray(r_0, dtype=np.float64)
+        r_bufs = [self.to_device(r, mf.READ_WRITE), cl.Buffer(self.ctx, mf.READ_WRITE, r.nbytes)]
+        v_buf = self.to_device(v_0, mf.READ_WRITE)
+        a_buf = cl.Buffer(self.ctx, mf.READ_WRITE, r.nbytes)
+        m_buf = cl.Buffer(self.ctx, mf.READ_ONLY | mf.COPY_HOST_PTR, hostbuf=m)
+
+        def launch(first):
+            kernel(
+                self.queue, global_size, group_size,
+                r_bufs[0], r_bufs[1], v_buf, a_buf, m_buf,
+                np.float64(scale), np.float64(factor), np.float64(self.dt),
+                np.uint32(n_bodies), np.int32(first), *tiles
+            )
+            r_bufs.reverse()
+
+        def notify(step):
+            # v is synchronised with the positions the last launch started from
+            r_prev, v = np.empty_like(r), np.empty_like(r)
+            cl.enqueue_copy(self.queue, r_prev, r_bufs[1])
+            cl.enqueue_copy(self.queue, v, v_buf)
+            self.notify(step, r_prev, v, m_0)
+
+        yield r
+        for i in range(1, self.n_iters):
+            launch(i == 1)
+            if self.observers:
+                notify(i - 1)
+            if i % every == 0:
+                snapshot = np.empty_like(r)
+                cl.enqueue_copy(self.queue, snapshot, r_bufs[0])
+                yield snapshot
+        if self.observers:
+            # one more launch completes the velocity of the final positions; the
+            # positions it computes are discarded
+            launch(self.n_iters == 1)
+            notify(self.n_iters - 1)
 
     def solve(self, r_0, v_0, m_0):
-        self.program = cl.Program(self.ctx, f"#define N_DIM {int(r_0.shape[1])}\n" + open("opencl_solver.cl").read()).build()
-        
-        result_shape = (self.n_iters, int(r_0.shape[0]) , int(r_0.shape[1]))
-        R = np.zeros(result_shape)
-        V = R.copy()
-        A = R.copy()
-        R[0] = r_0
-        V[0] = v_0
-
-        R_buf = cl.Buffer(self.ctx, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR, hostbuf=R)
-        V_buf = cl.Buffer(self.ctx, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR, hostbuf=V)
-        A_buf = cl.Buffer(self.ctx, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR, hostbuf=A)
-        m_buf = cl.Buffer(self.ctx, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR, hostbuf=m_0)
-        localmem = cl.LocalMemory(self.group_size)
-
-        self.program.solve(
-            self.queue, 
-            (r_0.shape[0],), 
-            None, 
-            R_buf, V_buf, A_buf, m_buf, 
-            np.double(self.G), np.double(self.dt), np.int32(r_0.shape[0]), 
-            np.int32(r_0.shape[1]), np.int32(self.n_iters), localmem)
-
-        R_np = np.empty_like(R)
-        cl.enqueue_copy(self.queue, R_np, R_buf)
-        return R_np
\ No newline at end of file
+        R = np.empty((self.n_iters,) + r_0.shape, dtype=self.dtype)
+        return trajectory.collect(self.stream(r_0, v_0, m_0), R)
@@ -1,14 +1,24 @@
-import functools
 import numpy as np
 from scipy.integrate import odeint
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import multiprocessing as mp
+import multiprocessing.connection
+from multiprocessing import shared_memory
+
+import reference_cache
+import trajectory
 
 @dataclass
 class PythonSolver:
     dt : float
     n_iters : int
     G : float = 6.6743 * 10 ** -11
+    dtype : type = np.float64
+    observers : list = field(default_factory=list, repr=False, compare=False)
+
+    def notify(self, step, r, v, m):
+        for observer in self.observers:
+            observer(self, step, r, v, m)
 
     @staticmethod
     def acceleration(r_i, m_i ,r_j, m_j, G=6.6743 * 10 ** -11):
@@ -17,28 +27,174 @@ class PythonSolver:
         f_m = G * m_j[:, None] * np.divide(r_ij, f_m_denom, out=np.zeros_like(r_ij), where=f_m_denom!=0)
         return np.sum(f_m, axis=1)
 
+    @staticmethod
+    def batch_acceleration(r, m, G=6.6743 * 10 ** -11):
+        r_ij = r[:, None, :, :] - r[:, :, None, :]
+        f_m_denom = np.linalg.norm(r_ij, axis=3) ** 3
+        f_m = G * m[:, None, :] * np.divide(1, f_m_denom, out=np.zeros_like(f_m_denom), where=f_m_denom!=0)
+        return np.einsum("bij,bijd->bid", f_m, r_ij)
+
+@dataclass
+class AccelerationWorkspace:
+    n_bodies : int
+    n_dim : int
+    tile_size : int = 128
+    dtype : type = np.float64
+
+    def __post_init__(self):
+        tile = max(1, min(self.tile_size, self.n_bodies))
+        self.r_ij = np.empty((self.n_dim, tile, tile), dtype=self.dtype)
+        self.kernel = np.empty((tile, tile), dtype=self.dtype)
+        self.weighted = np.empty((tile, tile), dtype=self.dtype)
+        self.mask = np.empty((tile, tile), dtype=bool)
+        # pair terms are rounded to dtype once, products and sums stay in float64
+        self.products = np.empty((tile, tile))
+        self.row = np.empty(tile)
+        self.col = np.empty(tile)
+        self.r = np.empty((self.n_bodies, self.n_dim))
+        self.m = np.empty(self.n_bodies)
+
+    @staticmethod
+    def unit(x):
+        return 2.0 ** np.round(np.log2(x)) if x > 0 else 1.0
+
+    def rescale(self, r, m, G):
+        # Work in units of powers of two close to the system size and the largest
+        # mass, so that 1 / |r_ij| ** 3 stays in float32 range. The scaling is exact,
+        # so float64 results are unaffected. Returns the factor back to SI units.
+        length = self.unit(np.max(np.ptp(r, axis=0)) if self.n_bodies else 0)
+        mass = self.unit(np.max(np.abs(m)) if self.n_bodies else 0)
+        np.multiply(r, 1 / length, out=self.r)
+        np.multiply(m, 1 / mass, out=self.m)
+        return G * mass / length ** 2
+
+    def __call__(self, r, m, G, out=None):
+        if out is None:
+            out = np.empty((self.n_bodies, self.n_dim))
+        out.fill(0)
+        factor = self.rescale(r, m, G)
+
+        tile = self.kernel.shape[0]
+        for lo_i in range(0, self.n_bodies, tile):
+            hi_i = min(lo_i + tile, self.n_bodies)
+            for lo_j in range(lo_i, self.n_bodies, tile):
+                hi_j = min(lo_j + tile, self.n_bodies)
+                self.accumulate_tile(out, lo_i, hi_i, lo_j, hi_j)
+
+        out *= factor
+        return out
+
+    def rows(self, r, m, G, out, lo, hi):
+        out[lo:hi] = 0
+        factor = self.rescale(r, m, G)
+
+        tile = self.kernel.shape[0]
+        for lo_i in range(lo, hi, tile):
+            hi_i = min(lo_i + tile, hi)
+            for lo_j in range(0, self.n_bodies, tile):
+                hi_j = min(lo_j + tile, self.n_bodies)
+                self.accumulate_tile(out, lo_i, hi_i, lo_j, hi_j, reaction=False)
+
+        out[lo:hi] *= factor
+        return out
+
+    def accumulate_tile(self, out, lo_i, hi_i, lo_j, hi_j, reaction=True):
+        n_i, n_j = hi_i - lo_i, hi_j - lo_j
+        r_ij = self.r_ij[:, :n_i, :n_j]
+        kernel = self.kernel[:n_i, :n_j]
+        weighted = self.weighted[:n_i, :n_j]
+        mask = self.mask[:n_i, :n_j]
+
+        r, m = self.r, self.m
+        kernel.fill(0)
+        for d in range(self.n_dim):
+            np.subtract(r[lo_j:hi_j, d], r[lo_i:hi_i, d, None], out=r_ij[d])
+            np.multiply(r_ij[d], r_ij[d], out=weighted)
+            kernel += weighted
+
+        # kernel = 1 / |r_ij| ** 3, zero for coincident bodies
+        np.sqrt(kernel, out=weighted)
+        kernel *= weighted
+        np.not_equal(kernel, 0, out=mask)
+        np.divide(1, kernel, out=kernel, where=mask)
+
+        # tiles above the diagonal also give the reaction forces on the j bodies
+        products = self.products[:n_i, :n_j]
+        for d in range(self.n_dim):
+            np.multiply(r_ij[d], kernel, out=products, dtype=np.float64)
+            np.matmul(products, m[lo_j:hi_j], out=self.row[:n_i])
+            out[lo_i:hi_i, d] += self.row[:n_i]
+            if reaction and lo_i != lo_j:
+                np.matmul(m[lo_i:hi_i], products, out=self.col[:n_j])
+                out[lo_j:hi_j, d] -= self.col[:n_j]
+
 @dataclass
 class OdeintSolver(PythonSolver):
 
-    @classmethod
-    def func_sys(cls, r_0, m, r_v, t):
-        r_v = r_v.reshape((-1, r_0.shape[1]))
-        middle = r_v.shape[0] // 2
-        result = np.zeros_like(r_v)
-        result[:middle] = r_v[middle:]
-        result[middle:] = cls.acceleration(r_v[:middle], m, r_v[:middle], m)
-        return result.flatten()
+    rtol : float = None
+    atol : float = None
+    cache_dir : str = None
+    cache_bytes : int = 2 ** 30
+
+    def func_sys(self, y, t):
+        # views into odeint's state and buffers allocated once per solve, so a
+        # call is a handful of in-place ufuncs
+        size = y.size // 2
+        r = y[:size].reshape(self.shape)
+        self.deriv[:size] = y[size:]
+        np.subtract(r[None], r[:, None], out=self.r_ij)
+        np.einsum("ijd,ijd->ij", self.r_ij, self.r_ij, out=self.inv_3)
+        # coincident pairs, including each body with itself, exert no force
+        np.not_equal(self.inv_3, 0, out=self.mask)
+        np.power(self.inv_3, 1.5, out=self.inv_3)
+        np.divide(self.Gm, self.inv_3, out=self.inv_3, where=self.mask)
+        np.einsum("ij,ijd->id", self.inv_3, self.r_ij, out=self.deriv[size:].reshape(self.shape))
+        return self.deriv
+
+    def integrate(self, r_0, v_0, m_0):
+        n_bodies, n_dim = r_0.shape
+        self.shape = r_0.shape
+        self.Gm = self.G * np.asarray(m_0, dtype=np.float64)
+        self.deriv = np.empty(2 * r_0.size)
+        self.r_ij = np.empty((n_bodies, n_bodies, n_dim))
+        self.inv_3 = np.empty((n_bodies, n_bodies))
+        self.mask = np.empty((n_bodies, n_bodies), dtype=bool)
 
-    def solve(self, r_0, v_0, m_0):
         t_range = np.arange(0, self.dt * self.n_iters, self.dt)
-        initial_conditions = np.concatenate((r_0, v_0)).flatten()
-        func = functools.partial(self.func_sys, r_0, m_0)
-        solution = odeint(func, initial_conditions, t_range)[:, :v_0.size]
-        return solution.reshape((self.n_iters, -1, r_0.shape[1]))
+        initial_conditions = np.concatenate((r_0, v_0)).flatten().astype(np.float64)
+        return odeint(self.func_sys, initial_conditions, t_range, rtol=self.rtol, atol=self.atol)
+
+    def solve(self, r_0, v_0, m_0):
+        if self.cache_dir is None:
+            solution = self.integrate(r_0, v_0, m_0)
+        else:
+            cache = reference_cache.ReferenceCache(self.cache_dir, self.cache_bytes)
+            key = reference_cache.cache_key(
+                r_0, v_0, m_0,
+                dt=float(self.dt), n_iters=int(self.n_iters), G=float(self.G), rtol=self.rtol, atol=self.atol
+            )
+            solution = cache.get(key)
+            if solution is None:
+                solution = cache.put(key, self.integrate(r_0, v_0, m_0))
+
+        R = solution[:, :v_0.size].reshape((self.n_iters, -1, r_0.shape[1]))
+        if self.observers:
+            V = solution[:, v_0.size:].reshape(R.shape)
+            for i in range(self.n_iters):
+                self.notify(i, R[i], V[i], m_0)
+        return R.astype(self.dtype)
 
 @dataclass
 class PythonVerletSolver(PythonSolver):
 
+    tile_size : int = 128
+    workspace : AccelerationWorkspace = field(default=None, init=False, repr=False, compare=False)
+
+    def acceleration(self, r, m, _r, _m, G=6.6743 * 10 ** -11):
+        if self.workspace is None or self.workspace.n_bodies != r.shape[0] or self.workspace.n_dim != r.shape[1]:
+            self.workspace = AccelerationWorkspace(r.shape[0], r.shape[1], self.tile_size, self.dtype)
+        return self.workspace(r, m, G)
+
     @staticmethod
     def r_step(r, v, a, dt):
         return r + v * dt + 0.5 * a * dt * dt
@@ -47,35 +203,311 @@ class PythonVerletSolver(PythonSolver):
     def v_step(v, a, next_a, dt):
         return v + 0.5 * (a + next_a) * dt
 
+    def steps(self, r, v, a, m, start, stop):
+        if a is None:
+            a = self.acceleration(r, m, r, m, self.G)
+
+        for i in range(start, stop):
+            r = self.r_step(r, v, a, self.dt)
+            next_a = self.acceleration(r, m, r, m, self.G)
+            v = self.v_step(v, a, next_a, self.dt)
+            a = next_a
+            self.notify(i, r, v, m)
+            yield i, r, v, a
+
+    def stream(self, r_0, v_0, m_0, every=1):
+        a = self.acceleration(r_0, m_0, r_0, m_0, self.G)
+        self.notify(0, r_0, v_0, m_0)
+        yield r_0
+
+        for i, r, _, _ in self.steps(r_0, v_0, a, m_0, 1, self.n_iters):
+            if i % every == 0:
+                yield r
+
     def solve(self, r_0, v_0, m_0):
-        result_shape = (self.n_iters, int(r_0.shape[0]) , 2)
-        R = np.zeros(result_shape)
-        V = R.copy()
-        A = R.copy()
+        R = np.empty((self.n_iters,) + r_0.shape, dtype=self.dtype)
+        return trajectory.collect(self.stream(r_0, v_0, m_0), R)
 
-        R[0] = r_0
-        V[0] = v_0
-        A[0] = self.acceleration(r_0, m_0, r_0, m_0)
+    def solve_batch(self, r_0, v_0, m_0, chunk_size=1024):
+        n_batch, n_bodies, n_dim = r_0.shape
+        R = np.empty((n_batch, self.n_iters, n_bodies, n_dim), dtype=self.dtype)
 
-        for i in range(self.n_iters - 1):
-            R[i + 1] = self.r_step(R[i], V[i], A[i], self.dt)
-            A[i + 1] = self.acceleration(R[i + 1], m_0, R[i + 1], m_0)
-            V[i + 1] = self.v_step(V[i], A[i], A[i + 1], self.dt)
+        for lo in range(0, n_batch, chunk_size):
+            hi = min(lo + chunk_size, n_batch)
+            r, v, m = r_0[lo:hi], v_0[lo:hi], m_0[lo:hi]
+            a = self.batch_acceleration(r, m, self.G)
+            R[lo:hi, 0] = r
+
+            for i in range(1, self.n_iters):
+                r = self.r_step(r, v, a, self.dt)
+                next_a = self.batch_acceleration(r, m, self.G)
+                v = self.v_step(v, a, next_a, self.dt)
+                a = next_a
+                R[lo:hi, i] = r
 
         return R
 
+def shared_acceleration_worker(blocks, n_bodies, n_dim, lo, hi, tile_size, dtype, connection):
+    r = np.ndarray((n_bodies, n_dim), buffer=blocks[0].buf)
+    m = np.ndarray((n_bodies,), buffer=blocks[1].buf)
+    a = np.ndarray((n_bodies, n_dim), buffer=blocks[2].buf)
+    G = np.ndarray((1,), buffer=blocks[3].buf)
+    workspace = AccelerationWorkspace(n_bodies, n_dim, tile_size, dtype)
+
+    try:
+        # True computes the rows into the shared output, False stops the worker
+        while connection.recv():
+            try:
+                workspace.rows(r, m, G[0], a, lo, hi)
+            except Exception as error:
+                connection.send(f"{type(error).__name__}: {error}")
+                raise
+            connection.send(None)
+    except EOFError:
+        # the parent is gone
+        pass
+    finally:
+        del r, m, a, G
+        for block in blocks:
+            block.close()
+
 @dataclass
 class MultiprocessingVerletSolver(PythonVerletSolver):
 
     n_workers : int = 5
 
     def __post_init__(self):
-        self.pool = mp.Pool(self.n_workers)
+        self.workers = []
+        self.connections = []
+        self.blocks = []
+
+    def start_workers(self, n_bodies, n_dim):
+        self.close()
+
+        sizes = [n_bodies * n_dim, n_bodies, n_bodies * n_dim, 1]
+        self.blocks = [shared_memory.SharedMemory(create=True, size=max(1, size) * 8) for size in sizes]
+        self.r = np.ndarray((n_bodies, n_dim), buffer=self.blocks[0].buf)
+        self.m = np.ndarray((n_bodies,), buffer=self.blocks[1].buf)
+        self.a = np.ndarray((n_bodies, n_dim), buffer=self.blocks[2].buf)
+        self.shared_G = np.ndarray((1,), buffer=self.blocks[3].buf)
+
+        # np.array_split bounds: the first N % n_workers workers get one extra body
+        size, extra = divmod(n_bodies, self.n_workers)
+        bounds = np.cumsum([0] + [size + (k < extra) for k in range(self.n_workers)])
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            connection, worker_connection = mp.Pipe()
+            worker = mp.Process(
+                target=shared_acceleration_worker,
+                args=(self.blocks, n_bodies, n_dim, lo, hi, self.tile_size, self.dtype, worker_connection),
+                daemon=True
+            )
+            worker.start()
+            worker_connection.close()
+            self.workers.append(worker)
+            self.connections.append(connection)
+
+    def wait_workers(self):
+        # pipes instead of barriers: a worker killed mid-step, e.g. by the OOM killer,
+        # shows up as a ready sentinel instead of a barrier that never opens
+        pending = set(self.connections)
+        sentinels = {worker.sentinel for worker in self.workers}
+        while pending:
+            for ready in mp.connection.wait(list(pending) + list(sentinels)):
+                if ready in pending:
+                    pending.discard(ready)
+                    try:
+                        error = ready.recv()
+                    except (EOFError, OSError):
+                        self.fail("acceleration worker exited")
+                    if error is not None:
+                        self.fail(f"acceleration worker raised {error}")
+                elif ready in sentinels:
+                    self.fail("acceleration worker exited")
+
+    def fail(self, message):
+        workers = self.workers
+        self.close()
+        exit_codes = [worker.exitcode for worker in workers]
+        raise RuntimeError(f"{message}, worker exit codes {exit_codes}")
+
+    def acceleration(self, r, m, _r, _m, G=6.6743 * 10 ** -11):
+        if not self.workers or self.r.shape != r.shape:
+            self.start_workers(*r.shape)
+
+        self.r[:] = r
+        self.m[:] = m
+        self.shared_G[0] = G
+        try:
+            for connection in self.connections:
+                connection.send(True)
+        except OSError:
+            self.fail("acceleration worker exited")
+        self.wait_workers()
+        return self.a.copy()
+
+    def close(self):
+        if self.workers:
+            for connection in self.connections:
+                try:
+                    connection.send(False)
+                except OSError:
+                    # the worker already exited, e.g. terminated at interpreter exit
+                    pass
+            for worker in self.workers:
+                worker.join(timeout=5)
+                if worker.is_alive():
+                    worker.terminate()
+            for connection in self.connections:
+                connection.close()
+            self.workers = []
+            self.connections = []
+
+        if self.blocks:
+            del self.r, self.m, self.a, self.shared_G
+            for block in self.blocks:
+                block.close()
+                block.unlink()
+            self.blocks = []
+
+    def __del__(self):
+        self.close()
+
+@dataclass
+class BarnesHutVerletSolver(PythonVerletSolver):
+
+    theta : float = 0.5
+    leaf_size : int = 1
+    max_depth : int = 64
+
+    def build_tree(self, r, m):
+        n_dim = r.shape[1]
+        low, high = r.min(axis=0), r.max(axis=0)
+        bits = 1 << np.arange(n_dim)
+        signs = np.array([[1 if code & bit else -1 for bit in bits] for code in range(1 << n_dim)])
+
+        com, mass, width, children, bodies = [], [], [], [], []
+        stack = [(np.arange(r.shape[0]), (low + high) / 2, np.max(high - low) / 2, 0, None)]
+        while stack:
+            idx, center, half, depth, parent = stack.pop()
+            node = len(mass)
+            if parent is not None:
+                children[parent].append(node)
+
+            node_mass = m[idx].sum()
+            if node_mass != 0:
+                com.append(m[idx] @ r[idx] / node_mass)
+            else:
+                com.append(r[idx].mean(axis=0))
+            mass.append(node_mass)
+            width.append(2 * half)
+            children.append([])
+
+            if idx.size <= self.leaf_size or depth >= self.max_depth or half == 0:
+                bodies.append(idx)
+                continue
+            bodies.append(None)
+
+            codes = (r[idx] > center) @ bits
+            for code in np.unique(codes):
+                stack.append((idx[codes == code], center + signs[code] * half / 2, half / 2, depth + 1, node))
+
+        return np.array(com), np.array(mass), np.array(width), children, bodies
 
     def acceleration(self, r, m, _r, _m, G=6.6743 * 10 ** -11):
-        splitted_r = np.split(r, self.n_workers)
-        splitted_m = np.split(m, self.n_workers)
+        com, mass, width, children, bodies = self.build_tree(r, m)
+        result = np.zeros_like(r)
+
+        stack = [(0, np.arange(r.shape[0]))]
+        while stack:
+            node, targets = stack.pop()
+            if bodies[node] is not None:
+                result[targets] += PythonSolver.acceleration(r[targets], m[targets], r[bodies[node]], m[bodies[node]], G)
+                continue
+
+            r_ij = com[node] - r[targets]
+            dist = np.linalg.norm(r_ij, axis=1)
+            far = width[node] < self.theta * dist
+            result[targets[far]] += G * mass[node] * r_ij[far] / dist[far, None] ** 3
+
+            near = targets[~far]
+            if near.size:
+                stack.extend((child, near) for child in children[node])
+
+        return result
 
-        func = functools.partial(super().acceleration, r_j=r, m_j=m)
-        result = self.pool.starmap(func, zip(splitted_r, splitted_m))
-        return np.vstack(result)
\ No newline at end of file
+
+@dataclass
+class BlockTimestepHermiteSolver(PythonSolver):
+
+    eta : float = 0.02
+    max_level : int = 8
+
+    @staticmethod
+    def acceleration_jerk(r_i, v_i, r_j, v_j, m_j, G=6.6743 * 10 ** -11):
+        r_ij = r_j - r_i[:, None]
+        v_ij = v_j - v_i[:, None]
+        norm = np.linalg.norm(r_ij, axis=2)[..., None]
+        inv_3 = np.divide(G * m_j[:, None], norm ** 3, out=np.zeros_like(norm), where=norm!=0)
+        inv_2 = np.divide(1, norm ** 2, out=np.zeros_like(norm), where=norm!=0)
+        rv = np.sum(r_ij * v_ij, axis=2)[..., None]
+
+        a = np.sum(inv_3 * r_ij, axis=1)
+        j = np.sum(inv_3 * (v_ij - 3 * rv * inv_2 * r_ij), axis=1)
+        return a, j
+
+    def levels(self, a, j):
+        a_norm = np.linalg.norm(a, axis=1)
+        j_norm = np.linalg.norm(j, axis=1)
+        dt = np.divide(self.eta * a_norm, j_norm, out=np.full_like(a_norm, np.inf), where=j_norm!=0)
+        with np.errstate(divide="ignore"):
+            level = np.ceil(np.log2(self.dt / dt))
+        return np.clip(level, 0, self.max_level).astype(np.int64)
+
+    @staticmethod
+    def predict(r, v, a, j, tau):
+        tau = tau[:, None]
+        r_p = r + v * tau + a * tau ** 2 / 2 + j * tau ** 3 / 6
+        v_p = v + a * tau + j * tau ** 2 / 2
+        return r_p, v_p
+
+    def solve(self, r_0, v_0, m_0):
+        R = np.empty((self.n_iters,) + r_0.shape, dtype=self.dtype)
+        r, v = np.array(r_0, dtype=np.float64), np.array(v_0, dtype=np.float64)
+        a, j = self.acceleration_jerk(r, v, r, v, m_0, self.G)
+        self.n_force_evals = r.shape[0]
+
+        # time is counted in ticks of the finest level, dt / 2 ** max_level
+        tick = self.dt / (1 << self.max_level)
+        level = self.levels(a, j)
+        steps = 1 << (self.max_level - level)
+        t = np.zeros(r.shape[0], dtype=np.int64)
+
+        R[0] = r
+        self.notify(0, r, v, m_0)
+        now, end = 0, (self.n_iters - 1) << self.max_level
+        while now < end:
+            now = np.min(t + steps)
+            active = np.flatnonzero(t + steps == now)
+
+            r_p, v_p = self.predict(r, v, a, j, (now - t) * tick)
+            a_1, j_1 = self.acceleration_jerk(r_p[active], v_p[active], r_p, v_p, m_0, self.G)
+            self.n_force_evals += active.size
+
+            h = ((now - t[active]) * tick)[:, None]
+            v_1 = v[active] + (a[active] + a_1) * h / 2 + (j[active] - j_1) * h ** 2 / 12
+            r[active] = r[active] + (v[active] + v_1) * h / 2 + (a[active] - a_1) * h ** 2 / 12
+            v[active], a[active], j[active], t[active] = v_1, a_1, j_1, now
+
+            # a body may always refine its step, but only coarsens by one level at a time
+            # and only when the current time is aligned to the coarser block
+            current = level[active]
+            wanted = self.levels(a_1, j_1)
+            aligned = now % (steps[active] << 1) == 0
+            level[active] = np.where(wanted > current, wanted, np.where((wanted < current) & aligned, current - 1, current))
+            steps[active] = 1 << (self.max_level - level[active])
+
+            if now % (1 << self.max_level) == 0:
+                R[now >> self.max_level] = r
+                self.notify(now >> self.max_level, r, v, m_0)
+
+        return R
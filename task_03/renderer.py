@@ -0,0 +1,194 @@
+import collections
+import multiprocessing as mp
+import os
+import shutil
+import subprocess
+import tempfile
+from dataclasses import dataclass
+
+import numpy as np
+
+import trajectory
+
+def hex_to_rgb(color):
+    color = color.lstrip("#")
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+@dataclass
+class RenderConfig:
+    colors : np.ndarray
+    radii : np.ndarray
+    extent : float
+    width : int = 480
+    height : int = 480
+    background : tuple = (0, 0, 25)
+    trail : int = 0
+    stride : int = 1
+    fps : int = 50
+
+    def __post_init__(self):
+        self.colors = np.array([hex_to_rgb(c) if isinstance(c, str) else c for c in self.colors], dtype=np.uint8)
+        self.radii = np.asarray(self.radii, dtype=np.float64)
+        self.scale = min(self.width, self.height) / (2 * self.extent)
+        # disc stamp offsets shared by all bodies, masked per body by radius
+        pixel_radii = np.maximum(self.radii * self.scale, 1)
+        self.pixel_radii = pixel_radii
+        p = int(np.ceil(pixel_radii.max()))
+        dy, dx = np.mgrid[-p:p + 1, -p:p + 1]
+        self.dx, self.dy = dx.ravel(), dy.ravel()
+        self.stamps = self.dx ** 2 + self.dy ** 2 <= pixel_radii[:, None] ** 2
+        # blend weight of each trail point, oldest first
+        self.trail_ages = np.linspace(0.2, 0.6, self.trail)
+
+    def n_frames(self, n_iters):
+        return trajectory.n_snapshots(n_iters, self.stride)
+
+    def palette(self):
+        # every colour a frame can contain, so GIF encoders never need to scan the frames
+        colors = [self.background] + list(self.colors)
+        if self.trail:
+            for age in self.trail_ages:
+                colors += list((np.array(self.background) * (1 - age) + self.colors * age).astype(np.uint8))
+        return np.array(colors[:256], dtype=np.uint8)
+
+    def to_pixels(self, r):
+        x = np.rint(self.width / 2 + r[..., 0] * self.scale).astype(np.int64)
+        y = np.rint(self.height / 2 - r[..., 1] * self.scale).astype(np.int64)
+        return x, y
+
+def draw_trails(frame, R, i, config):
+    lo = max(0, i - config.trail * config.stride)
+    history = np.asarray(R[lo:i:config.stride])
+    if not len(history):
+        return
+    x, y = config.to_pixels(history)
+    # older points fade towards the background; a short history takes the
+    # newest ages so every colour is in the palette
+    age = config.trail_ages[-len(history):, None, None]
+    color = (config.background * (1 - age) + config.colors[None] * age).astype(np.uint8)
+    color = np.broadcast_to(color, x.shape + (3,))
+    inside = (x >= 0) & (x < config.width) & (y >= 0) & (y < config.height)
+    frame[y[inside], x[inside]] = color[inside]
+
+def draw_bodies(frame, r, config):
+    x, y = config.to_pixels(r)
+    xs = x[:, None] + config.dx
+    ys = y[:, None] + config.dy
+    inside = config.stamps & (xs >= 0) & (xs < config.width) & (ys >= 0) & (ys < config.height)
+    body = np.broadcast_to(np.arange(len(r))[:, None], xs.shape)
+    frame[ys[inside], xs[inside]] = config.colors[body[inside]]
+
+def render_frame(R, i, config):
+    frame = np.empty((config.height, config.width, 3), dtype=np.uint8)
+    frame[:] = config.background
+    if config.trail:
+        draw_trails(frame, R, i, config)
+    draw_bodies(frame, np.asarray(R[i]), config)
+    return frame
+
+worker_state = {}
+
+def memmap_view(R):
+    # (path, byte offset, shape, strides, dtype) of a possibly sliced memory-mapped array
+    root = R
+    while isinstance(root.base, np.memmap):
+        root = root.base
+    offset = root.offset + R.ctypes.data - root.ctypes.data
+    return R.filename, offset, R.shape, R.strides, R.dtype
+
+def init_worker(source, config):
+    # memory-mapped trajectories are reopened from their file instead of being pickled
+    if isinstance(source, tuple):
+        path, offset, shape, strides, dtype = source
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        source = np.ndarray(shape, dtype, buffer=buffer, offset=offset, strides=strides)
+    worker_state["R"] = source
+    worker_state["config"] = config
+
+def render_worker(i):
+    return render_frame(worker_state["R"], i, worker_state["config"]).tobytes()
+
+def frames(R, config, n_workers=None):
+    if isinstance(R, str):
+        R = trajectory.load(R)
+    indices = range(0, len(R), config.stride)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    if n_workers == 1:
+        for i in indices:
+            yield render_frame(R, i, config)
+        return
+
+    source = memmap_view(R) if isinstance(R, np.memmap) and R.filename else R
+    shape = (config.height, config.width, 3)
+    with mp.Pool(n_workers, initializer=init_worker, initargs=(source, config)) as pool:
+        # Pool.imap would queue every index and keep finished frames until they are
+        # consumed, so submit through a bounded window to stall the workers behind the writer
+        pending = collections.deque()
+        for i in indices:
+            pending.append(pool.apply_async(render_worker, (i,)))
+            if len(pending) >= 2 * n_workers:
+                yield np.frombuffer(pending.popleft().get(), dtype=np.uint8).reshape(shape)
+        while pending:
+            yield np.frombuffer(pending.popleft().get(), dtype=np.uint8).reshape(shape)
+
+def ffmpeg_writer(path, config, palette_path=None):
+    command = [
+        shutil.which("ffmpeg"), "-loglevel", "error", "-y",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{config.width}x{config.height}", "-r", str(config.fps),
+        "-i", "-",
+    ]
+    if palette_path:
+        # a fixed palette keeps ffmpeg streaming, palettegen would buffer the whole video
+        command += [
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "16x16", "-i", palette_path,
+            "-filter_complex", "[0:v][1:v]paletteuse=dither=none",
+        ]
+    else:
+        command += ["-pix_fmt", "yuv420p"]
+    return subprocess.Popen(command + [path], stdin=subprocess.PIPE)
+
+def save_with_ffmpeg(stream, path, config):
+    with tempfile.TemporaryDirectory() as tmp:
+        palette_path = None
+        if path.endswith(".gif"):
+            palette = config.palette()
+            # paletteuse wants exactly 256 entries, pad with the background
+            palette = np.concatenate([palette, np.broadcast_to(palette[:1], (256 - len(palette), 3))])
+            palette_path = os.path.join(tmp, "palette.rgb")
+            palette.tofile(palette_path)
+        process = ffmpeg_writer(path, config, palette_path)
+        try:
+            for frame in stream:
+                process.stdin.write(frame.tobytes())
+        finally:
+            process.stdin.close()
+            if process.wait():
+                raise RuntimeError(f"ffmpeg failed writing {path}")
+
+def save_with_pillow(stream, path, config):
+    from PIL import Image, GifImagePlugin
+
+    # Image.save(save_all=True) collects every frame before writing, so the GIF is
+    # assembled block by block and each frame is dropped once it is encoded
+    palette = Image.new("P", (1, 1))
+    palette.putpalette(config.palette().ravel().tolist())
+    duration = 1000 // config.fps
+
+    with open(path, "wb") as f:
+        for k, frame in enumerate(stream):
+            image = Image.fromarray(frame).quantize(palette=palette, dither=Image.Dither.NONE)
+            if not k:
+                header, _ = GifImagePlugin.getheader(image, info={"loop" : 0, "duration" : duration, "optimize" : False})
+                f.writelines(header)
+            f.writelines(GifImagePlugin.getdata(image, duration=duration))
+        f.write(b";")
+
+def save(R, path, config, n_workers=None):
+    stream = frames(R, config, n_workers)
+    if shutil.which("ffmpeg"):
+        save_with_ffmpeg(stream, path, config)
+    elif path.endswith(".gif"):
+        save_with_pillow(stream, path, config)
+    else:
+        raise RuntimeError(f"ffmpeg is required to write {path}")
@@ -1,8 +1,29 @@
-from setuptools import setup
+import sys
+from setuptools import setup, Extension
 from Cython.Build import cythonize
 import numpy
 
+if sys.platform == "win32":
+    openmp_compile_args = ["/O2", "/openmp"]
+    openmp_link_args = []
+elif sys.platform == "darwin":
+    openmp_compile_args = ["-O3", "-Xpreprocessor", "-fopenmp"]
+    openmp_link_args = ["-lomp"]
+else:
+    openmp_compile_args = ["-O3", "-fopenmp"]
+    openmp_link_args = ["-fopenmp"]
+
+extensions = [
+    Extension(
+        "cython_solver",
+        ["cython_solver.pyx"],
+        include_dirs=[numpy.get_include()],
+        extra_compile_args=openmp_compile_args,
+        extra_link_args=openmp_link_args,
+    )
+]
+
 setup(
-    ext_modules = cythonize("cython_solver.pyx"),
+    ext_modules = cythonize(extensions),
     include_dirs=[numpy.get_include()]
-)
\ No newline at end of file
+)
@@ -1,13 +1,16 @@
 from dataclasses import dataclass
+import os
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.lines as lines
-import matplotlib.animation as anime
 from importlib import reload
 
 import python_solvers
 import cython_solver
 import opencl_solver
+import diagnostics
+import integrators
+import renderer
+import trajectory
 
 @dataclass
 class PlanetInfo:
@@ -21,44 +24,55 @@ class PlanetInfo:
 def arr(l):
     return np.array(l, dtype=np.float64)
 
-def planet_to_circle(planet):
-    circle = plt.Circle(planet.r_0, planet.radius, fc = planet.color)
-    return circle
+def render_config(planets, R, trail=20):
+    return renderer.RenderConfig(
+        [planet.color for planet in planets],
+        [planet.radius for planet in planets],
+        extent=1.1 * np.max(np.abs(R[:, :, :2])),
+        trail=trail
+    )
 
-def animate_planets(planets, R, title="some_title"):
-    n_iters = 1000
-    w = 5 * scale
-    h = 5 * scale
-    plt.style.use("dark_background")
-    fig = plt.figure()
-    ax = plt.axes(xlim=(-w, w), ylim=(-h, h))
-    ax.set_facecolor((0, 0, 0.1))
-    ax.set_title(title, color="#ffffff")
-
-    lw = 4
-    legend_elements = [lines.Line2D([0], [0], color=i.color, lw=lw) for i in planets]
-    ax.legend(legend_elements, [i.name for i in planets], loc='upper right')
-    planet_circles = [planet_to_circle(planet) for planet in planets]
-
-    def init():
-        for pc in planet_circles:
-            ax.add_patch(pc)
-        return planet_circles
-
-    def animate(i):
-        j = i % n_iters
-        for k in range(r_0.shape[0]):
-            planet_circles[k].center = R[j, k]
-        return planet_circles
-
-
-    anim = anime.FuncAnimation(fig,
-                            animate,
-                            init_func=init,
-                            frames=360,
-                            interval=20,
-                            blit=True)
-    anim.save(f"plots\\{title}.gif")
+def animate_planets(planets, R, title="some_title", trail=20):
+    renderer.save(R, os.path.join("plots", f"{title}.gif"), render_config(planets, R, trail))
+
+def check_parallel_frames(planets, R):
+    # workers reopen memory-mapped trajectories from the file, slices must survive that
+    R = R[len(R) // 5::3]
+    config = render_config(planets, R)
+    serial = list(renderer.frames(R, config, n_workers=1))
+    parallel = list(renderer.frames(R, config, n_workers=2))
+    assert len(serial) == len(parallel) and all(np.array_equal(a, b) for a, b in zip(serial, parallel)), \
+        "parallel rendering of a sliced trajectory differs from serial"
+
+# float32 runs must stay this close to the float64 run of the same backend,
+# relative to the size of the system
+FLOAT32_RTOL = 1e-6
+
+def mean_error(reference, solution):
+    diff = np.sqrt(np.sum((reference - solution) ** 2, axis=2))
+    return np.mean(diff)
+
+def accuracy_per_force_evaluation(reference, r_0, v_0, m_0, dt, n_iters, G, refinements=(1, 2, 4, 8)):
+    results = {}
+    for scheme in integrators.SCHEMES:
+        results[scheme] = []
+        for k in refinements:
+            solver = integrators.SymplecticSolver(dt / k, n_iters * k, G, scheme)
+            error = mean_error(reference, solver.solve(r_0, v_0, m_0)[::k])
+            results[scheme].append((solver.n_force_evals, error))
+            print(f"{scheme} : dt/{k} : {solver.n_force_evals} force evaluations : error {error:.3e}")
+    return results
+
+def plot_accuracy(results):
+    plt.clf()
+    plt.title("Error vs force evaluations")
+    for scheme in results:
+        n_evals, errors = zip(*results[scheme])
+        plt.loglog(n_evals, errors, marker="o", label=scheme)
+    plt.xlabel("force evaluations")
+    plt.ylabel("mean error vs odeint")
+    plt.legend()
+    plt.savefig(os.path.join("plots", "accuracy.png"))
 
 if __name__ == "__main__":
     scale = 10 ** 12
@@ -122,15 +136,33 @@ if __name__ == "__main__":
     v_0 = np.vstack([i.v_0 for i in planets])
 
     solvers = {
-        "odeint" : python_solvers.OdeintSolver(dt, n_iters, G),
+        "odeint" : python_solvers.OdeintSolver(dt, n_iters, G, cache_dir=os.path.join("plots", "cache")),
         "python" : python_solvers.PythonVerletSolver(dt, n_iters, G),
         "cython" : cython_solver.CythonSolver(dt, n_iters, G),
         "multiprocessing" : python_solvers.MultiprocessingVerletSolver(dt, n_iters, G, n_workers=len(planets)),
-        "opencl" : opencl_solver.OpenCLSolver(dt, n_iters, G)
+        "opencl" : opencl_solver.OpenCLSolver(dt, n_iters, G),
+        "barnes-hut" : python_solvers.BarnesHutVerletSolver(dt, n_iters, G),
+        "block-hermite" : python_solvers.BlockTimestepHermiteSolver(dt, n_iters, G),
+        "python-float32" : python_solvers.PythonVerletSolver(dt, n_iters, G, np.float32),
+        "cython-float32" : cython_solver.CythonSolver(dt, n_iters, G, np.float32),
+        "opencl-float32" : opencl_solver.OpenCLSolver(dt, n_iters, G, dtype=np.float32)
     }
     solutions = {}
     for solver in solvers:
-        solutions[solver] = solvers[solver].solve(r_0, v_0, m_0)
+        monitor = diagnostics.ConservationMonitor(every=10)
+        if hasattr(solvers[solver], "observers"):
+            solvers[solver].observers.append(monitor)
+        if hasattr(solvers[solver], "stream"):
+            path = os.path.join("plots", f"{solver}.npy")
+            trajectory.save(solvers[solver], r_0, v_0, m_0, path)
+            solutions[solver] = trajectory.load(path)
+        else:
+            solutions[solver] = solvers[solver].solve(r_0, v_0, m_0)
+        if hasattr(solvers[solver], "n_force_evals"):
+            print(f"{solver} : {solvers[solver].n_force_evals} body force evaluations")
+        if monitor.records:
+            series = monitor.series
+            print(f"{solver} : max energy drift {series['energy_drift'].max():.2e}, max angular momentum drift {series['angular_momentum_drift'].max():.2e}")
         animate_planets(planets, solutions[solver], solver)
     plt.clf()
     plt.title("Погрешность по сравнению с odeint")
@@ -142,4 +174,15 @@ if __name__ == "__main__":
 
         plt.plot(diff, label=solver, alpha=0.7)
     plt.legend()
-    plt.savefig("plots\\diff.png")
\ No newline at end of file
+    plt.savefig("plots\\diff.png")
+
+    extent = np.max(np.abs(solutions["odeint"]))
+    for solver in solutions:
+        if solver.endswith("-float32"):
+            error = np.max(np.linalg.norm(solutions[solver] - solutions[solver[:-len("-float32")]], axis=2)) / extent
+            print(f"{solver} : max deviation from float64 {error:.2e} (tolerance {FLOAT32_RTOL:.0e})")
+            assert error <= FLOAT32_RTOL, f"{solver} deviates from float64 by {error:.2e}"
+
+    check_parallel_frames(planets, solutions["python"])
+
+    plot_accuracy(accuracy_per_force_evaluation(solutions["odeint"], r_0, v_0, m_0, dt, n_iters, G))
\ No newline at end of file
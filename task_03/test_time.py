@@ -1,42 +1,13 @@
 from collections import defaultdict
+import os
 import numpy as np
 import cython_solver
 import python_solvers
 import opencl_solver
-import time
 import pandas as pd
 import matplotlib.pyplot as plt
 
-from dataclasses import dataclass
-
-@dataclass
-class InitData:
-    dt : float
-    n_iters : int
-    G : float = 6.6743 * 10 ** -11
-
-@dataclass
-class TestData:
-    r_0 : np.ndarray
-    v_0 : np.ndarray
-    m_0 : np.ndarray
-
-def bench(n_calls, func, *args, **kwargs):
-    result = []
-    for _ in range(n_calls):
-        start = time.time()
-        func(*args, **kwargs)
-        result.append(time.time() - start)
-    return np.mean(result)
-
-def make_solver(solver_cls, init_data):
-    return solver_cls(**init_data.__dict__)
-
-def make_test_case(n_obj, n_dim):
-    r = np.random.random_sample((n_obj, n_dim)).astype(np.float64)
-    v = np.random.random_sample((n_obj, n_dim)).astype(np.float64)
-    m = np.random.random_sample((n_obj,)).astype(np.float64)
-    return TestData(r, v, m)
+import benchmark
 
 def plot_boosts(plot_data, k):
     for solver_name in plot_data:
@@ -45,7 +16,7 @@ def plot_boosts(plot_data, k):
     plt.xlabel("n bodies")
     plt.ylabel("time, s")
     plt.legend()
-    plt.savefig("plots\\runtimes.png")
+    plt.savefig(os.path.join("plots", "runtimes.png"))
 
     plt.clf()
     for solver_name in plot_data:
@@ -54,7 +25,7 @@ def plot_boosts(plot_data, k):
     plt.ylabel("coefficient")
     plt.xlabel("n bodies")
     plt.legend()
-    plt.savefig("plots\\boosts.png")
+    plt.savefig(os.path.join("plots", "boosts.png"))
 
 
 def main():
@@ -63,30 +34,25 @@ def main():
         "python" : python_solvers.PythonVerletSolver,
         "cython" : cython_solver.CythonSolver,
         "multiprocessing" : python_solvers.MultiprocessingVerletSolver,
-        "opencl" : opencl_solver.OpenCLSolver
+        "opencl" : opencl_solver.OpenCLSolver,
+        "barnes-hut" : python_solvers.BarnesHutVerletSolver
     }
 
     n_dim = 2
     test_cases = [50, 100, 200]
     dt = pow(10, 7) * 1.5
-    init_data_100 = InitData(dt, 100)
 
-    results = {}
-    for k in test_cases:
-        test_case = make_test_case(k, n_dim)
-        for solver_name in solver_classes:
-            solver = make_solver(solver_classes[solver_name], init_data_100)
-            results[(solver_name, k)] = bench(3, solver.solve, **test_case.__dict__)
-            print(f"{solver_name} : {k} : {results[(solver_name, k)]}")
+    results = benchmark.run(solver_classes, test_cases, [n_dim], [100], dt, warmup=1, repeats=5)
+    benchmark.save(results, os.path.join("plots", "runtimes.json"))
 
-    df_data = [(k[0], k[1], results[k]) for k in results]
+    df_data = [(r["solver"], r["n_bodies"], r["solve"]["median"]) for r in results["results"]]
     df = pd.DataFrame(df_data, columns=["method", "n_obj", "time"])
 
     plot_data = defaultdict(list)
     for solver_name in solver_classes:
         for k in sorted(test_cases):
-            plot_data[solver_name].append(results[(solver_name, k)])
-    plot_boosts(plot_data, test_cases)
+            plot_data[solver_name].append(df[(df.method == solver_name) & (df.n_obj == k)].time.iloc[0])
+    plot_boosts(plot_data, sorted(test_cases))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,20 @@
+import numpy as np
+
+def n_snapshots(n_iters, every=1):
+    return (n_iters + every - 1) // every
+
+def collect(snapshots, out):
+    for i, r in enumerate(snapshots):
+        out[i] = r
+    return out
+
+def save(solver, r_0, v_0, m_0, path, every=1, dtype=None):
+    dtype = dtype or getattr(solver, "dtype", np.float64)
+    shape = (n_snapshots(solver.n_iters, every),) + r_0.shape
+    R = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+    collect(solver.stream(r_0, v_0, m_0, every), R)
+    R.flush()
+    return R
+
+def load(path):
+    return np.load(path, mmap_mode="r")